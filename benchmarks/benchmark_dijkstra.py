@@ -0,0 +1,92 @@
+"""
+Compare the shortest path routines of flexsipp.graphs.graph with the queue.PriorityQueue based implementation they
+replaced, on the station-to-station queries made while loading a scenario.
+
+Usage: python benchmarks/benchmark_dijkstra.py <location.json> <scenario.json> [<scenario.json> ...]
+e.g.   python benchmarks/benchmark_dijkstra.py data/prorail/parsed/netherlands-schiphol.json data/prorail/scenarios/TAD/TheHague/*.json
+"""
+import json
+import queue as Q
+import sys
+from time import perf_counter
+
+from flexsipp.generate import graph_from_file
+
+
+def priority_queue_distance(g, start, end, agent_velocity):
+    """The distance_between_nodes implementation before the heapq based engine."""
+    time_distances = {n: sys.maxsize for n in g.nodes}
+    pq = Q.PriorityQueue()
+    time_distances[start.name] = 0
+    pq_counter = 0
+    pq.put((time_distances[start.name], pq_counter, start))
+    pq_counter += 1
+    while not pq.empty():
+        u = pq.get()[2]
+        for e in u.outgoing:
+            velocity = min(e.max_speed, agent_velocity)
+            tmp = time_distances[u.name] + (e.length / velocity)
+            v = e.to_node
+            if tmp < time_distances[v.name]:
+                time_distances[v.name] = tmp
+                if end is not None and v.name == end.name:
+                    return tmp
+                pq.put((time_distances[v.name], pq_counter, v))
+                pq_counter += 1
+    return sys.maxsize
+
+
+def station_queries(g, scenario_files):
+    """All (start block, end block, velocity) distance queries made to route the trains of the scenarios."""
+    queries = []
+    for file in scenario_files:
+        with open(file) as f:
+            data = json.load(f)
+        speeds = {t["name"]: t["speed"] / 3.6 for t in data["types"]}
+        for train in data["trains"]:
+            movements = train["movements"]
+            stops = movements["stops"]
+            stations = [movements["startLocation"]]
+            stations += list(stops) if isinstance(stops, dict) else [stop["location"] for stop in stops]
+            stations.append(movements["endLocation"])
+            velocity = speeds[train["trainUnitTypes"][0]]
+            for a, b in zip(stations, stations[1:]):
+                if a not in g.tg.stations or b not in g.tg.stations:
+                    continue
+                for start in g.get_block_from_station(a):
+                    for end in g.get_block_from_station(b):
+                        queries.append((start, end, velocity))
+    return queries
+
+
+def benchmark(location, scenario_files):
+    g = graph_from_file(location)
+    queries = station_queries(g, scenario_files)
+    print(f"{len(g.nodes)} nodes, {len(g.edges)} edges, {len(queries)} distance queries")
+
+    ts = perf_counter()
+    expected = [priority_queue_distance(g, *q) for q in queries]
+    old_time = perf_counter() - ts
+
+    ts = perf_counter()
+    for start, end, velocity in queries:
+        # Bypass the station distance oracle of the BlockGraph to time the early-exit search itself
+        super(type(g), g).distance_between_nodes(start, end, velocity)
+    new_time = perf_counter() - ts
+
+    ts = perf_counter()
+    oracle = [g.distance_between_nodes(*q) for q in queries]
+    oracle_time = perf_counter() - ts
+
+    differences = sum(1 for a, b in zip(expected, oracle) if a != b)
+    print(f"queue.PriorityQueue: {old_time:2.4f} seconds")
+    print(f"heapq early exit:    {new_time:2.4f} seconds ({old_time / max(new_time, 1e-9):.1f}x)")
+    print(f"distance oracle:     {oracle_time:2.4f} seconds ({old_time / max(oracle_time, 1e-9):.1f}x)")
+    print(f"{differences} queries where the first relaxation of the goal was not its shortest distance")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    benchmark(sys.argv[1], sys.argv[2:])
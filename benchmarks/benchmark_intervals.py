@@ -0,0 +1,86 @@
+"""
+Compare the memory use of the slotted interval classes of flexsipp.util.intervals with the dict based classes they
+replaced, for a number of loose intervals and for processing a scenario and creating the FSIPP graphs of all agents.
+
+Usage: python benchmarks/benchmark_intervals.py [<location.json> <scenario.json>]
+e.g.   python benchmarks/benchmark_intervals.py tests/location_test.json tests/scenario_test.json
+"""
+import sys
+import tracemalloc
+
+from flexsipp.generate import graph_from_file, scenario_from_file
+from flexsipp.util.intervals import UnsafeInterval, SafeInterval
+
+N = 100_000
+
+
+class DictUnsafeInterval:
+    """UnsafeInterval before __slots__, including the global index counter."""
+    index = 0
+
+    def __init__(self, start, end, duration, by_agent, local_recovery_time):
+        self.start = start
+        self.end = end
+        self.index = DictUnsafeInterval.index
+        DictUnsafeInterval.index += 1
+        self.duration = duration
+        self.by_agent = by_agent
+        self.local_recovery_time = local_recovery_time
+
+
+class DictSafeInterval:
+    """SafeInterval before __slots__, including the global index counter."""
+    index = 0
+
+    def __init__(self, start, end, agent_before, crt_before, agent_after, buffer_after, crt_after):
+        self.start = start
+        self.end = end
+        self.index = DictSafeInterval.index
+        DictSafeInterval.index += 1
+        self.agent_before = agent_before
+        self.crt_before = crt_before
+        self.agent_after = agent_after
+        self.buffer_after = buffer_after
+        self.crt_after = crt_after
+
+
+def allocated(create) -> int:
+    """Bytes still allocated after calling create, while its result is alive."""
+    tracemalloc.start()
+    result = create()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def compare_intervals():
+    # Use distinct float objects like the intervals created during processing
+    cases = [
+        ("UnsafeInterval", lambda: [DictUnsafeInterval(i + 0.5, i + 1.5, 1.0, 0, 0.1) for i in range(N)],
+         lambda: [UnsafeInterval(i + 0.5, i + 1.5, 1.0, 0, 0.1) for i in range(N)]),
+        ("SafeInterval", lambda: [DictSafeInterval(i + 0.5, i + 1.5, 0, 0.0, 0, 0.0, 0.0) for i in range(N)],
+         lambda: [SafeInterval(i + 0.5, i + 1.5, 0, 0.0, 0, 0.0, 0.0, i) for i in range(N)]),
+    ]
+    print(f"{'':16}{'dict (B/interval)':>20}{'slots (B/interval)':>20}")
+    for name, dict_based, slotted in cases:
+        print(f"{name:16}{allocated(dict_based) / N:>20.1f}{allocated(slotted) / N:>20.1f}")
+
+
+def process_scenario(location, scenario_file):
+    bg = graph_from_file(location)
+    scenario = scenario_from_file(scenario_file, bg)
+    tracemalloc.start()
+    scenario.process()
+    fsipps = [scenario.create_fsipp(agent, prune=False) for agent in scenario.agents]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n_intervals = sum(len(node.safe_intervals) for f in fsipps for node in f.nodes.values())
+    print(f"{scenario_file}: {len(fsipps)} FSIPP graphs with {n_intervals} node intervals, "
+          f"{size / 2 ** 20:.1f} MiB allocated, peak {peak / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    compare_intervals()
+    if len(sys.argv) == 3:
+        process_scenario(sys.argv[1], sys.argv[2])
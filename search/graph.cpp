@@ -1,4 +1,6 @@
 #include <iostream>
+#include <cstdint>
+#include <cstring>
 #include <fstream>
 #include <boost/iostreams/device/file.hpp>
 #include <boost/iostreams/stream_buffer.hpp>
@@ -41,6 +43,16 @@ void read_ATF(std::istream& i, std::vector<inATF>& res){
     res.emplace_back(x, y, edge);
 }
 
+void connect_edges(Graph& g, const std::vector<inATF>& res){
+    g.edges.reserve(2*res.size());
+    for (const auto & entry: res){
+        g.edges.emplace_back(entry.eATF);
+        g.edges.back().source = &g.node_array[entry.source];
+        g.edges.back().destination = &g.node_array[entry.dest];
+        g.node_array[entry.source].successors.emplace_hint(g.node_array[entry.source].successors.end(), &g.edges.back());
+    }
+}
+
 Graph read_graph(std::string filename){
     boost::iostreams::file_source fileSource(filename);
 
@@ -101,13 +113,104 @@ Graph read_graph(std::string filename){
     std::cerr << "num_agents:" << n_agents << std::endl;
     std::flush(std::cerr);
     g.n_agents = n_agents;
-    g.edges.reserve(2*res.size());
-    for (const auto & entry: res){
-        g.edges.emplace_back(entry.eATF);
-        g.edges.back().source = &g.node_array[entry.source];
-        g.edges.back().destination = &g.node_array[entry.dest];
-        g.node_array[entry.source].successors.emplace_hint(g.node_array[entry.source].successors.end(), &g.edges.back());
+    connect_edges(g, res);
+    return g;
+}
+
+template<typename T>
+T read_field(const char *& p){
+    // The binary format is little-endian, like the hosts the search runs on
+    T value;
+    std::memcpy(&value, p, sizeof(T));
+    p += sizeof(T);
+    return value;
+}
+
+Graph read_graph_binary(std::string filename){
+    std::ifstream instream(filename, std::ios::binary);
+
+    if (!instream.is_open()) {
+        std::cerr << "Failed to open file: " << filename << std::endl;
     }
+
+    // Header, see HEADER in flexsipp/graphs/binary_edge_graph.py
+    char header[48];
+    instream.read(header, sizeof(header));
+    const char * p = header;
+    if (std::string(p, 8) != "FSIPPBIN") {
+        std::cerr << "Not a binary edge graph: " << filename << std::endl;
+        exit(-1);
+    }
+    p += 8;
+    auto version = read_field<uint32_t>(p);
+    if (version != 1) {
+        std::cerr << "Unsupported binary edge graph version: " << version << std::endl;
+        exit(-1);
+    }
+    p += sizeof(uint32_t);
+    auto n_names = read_field<int64_t>(p);
+    auto n_nodes = read_field<int64_t>(p);
+    auto n_edges = read_field<int64_t>(p);
+    auto n_agents = read_field<int64_t>(p);
+
+    std::vector<int64_t> offsets(n_names + 1);
+    instream.read(reinterpret_cast<char *>(offsets.data()), sizeof(int64_t) * offsets.size());
+    std::string names(offsets.back(), '\0');
+    instream.read(names.data(), names.size());
+
+    Graph g;
+    g.nodes.reserve(n_nodes);
+    g.node_array.reserve(n_nodes);
+    // name, start, end, id_b, crt_b, id_a, buf_a, crt_a
+    constexpr size_t vertex_size = 3 * sizeof(int32_t) + 5 * sizeof(double);
+    std::vector<char> records(vertex_size * n_nodes);
+    instream.read(records.data(), records.size());
+    p = records.data();
+    for (int64_t i = 0; i < n_nodes; i++){
+        auto name_id = read_field<int32_t>(p);
+        auto st = read_field<double>(p);
+        auto en = read_field<double>(p);
+        auto id_b = read_field<int32_t>(p);
+        read_field<double>(p);
+        auto id_a = read_field<int32_t>(p);
+        auto buf_a = read_field<double>(p);
+        read_field<double>(p);
+        State state(names.substr(offsets[name_id], offsets[name_id + 1] - offsets[name_id]), st, en, id_b, id_a, buf_a);
+        g.node_array.emplace_back(state);
+        g.nodes.emplace(state, &g.node_array.back());
+    }
+    std::cerr << "nodes read\n";
+
+    // from, to, zeta, alpha, beta, delta, id_b, crt_b, id_a, buf_a, crt_a, h
+    constexpr size_t atf_size = 2 * sizeof(int64_t) + 2 * sizeof(int32_t) + 8 * sizeof(double);
+    records.resize(atf_size * n_edges);
+    instream.read(records.data(), records.size());
+    p = records.data();
+    std::vector<inATF> res;
+    res.reserve(n_edges);
+    for (int64_t i = 0; i < n_edges; i++){
+        auto x = read_field<int64_t>(p);
+        auto y = read_field<int64_t>(p);
+        auto zeta = read_field<double>(p);
+        auto alpha = read_field<double>(p);
+        auto beta = read_field<double>(p);
+        auto delta = read_field<double>(p);
+        auto id_b = read_field<int32_t>(p);
+        auto crt_b = read_field<double>(p);
+        auto id_a = read_field<int32_t>(p);
+        auto max_buf_a = read_field<double>(p);
+        auto crt_a = read_field<double>(p);
+        auto h = read_field<double>(p);
+        res.emplace_back(x, y, EdgeATF(zeta, alpha, beta, delta, id_b, crt_b, id_a, max_buf_a, crt_a, h));
+    }
+    if (!instream) {
+        std::cerr << "Binary edge graph is truncated: " << filename << std::endl;
+        exit(-1);
+    }
+    std::cerr << "atfs read\n";
+    std::cerr << "num_agents:" << n_agents << std::endl;
+    g.n_agents = n_agents;
+    connect_edges(g, res);
     return g;
 }
 
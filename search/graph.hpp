@@ -82,4 +82,5 @@ struct Graph{
 };
 
 Graph read_graph(std::string filename);
+Graph read_graph_binary(std::string filename);
 GraphNode * find_earliest(Graph& g, Location loc, double start_time);
\ No newline at end of file
@@ -19,7 +19,8 @@ int main(int argc, char* argv[]) {
                     ("start,x", po::value<std::string>(), "starting location")
                     ("goal,y", po::value<std::string>(), "goal location")
                     ("edgegraph,g", po::value<std::filesystem::path>(),
-                     "gzip'd file containing the edge arrival time functions.")
+                     "gzip'd file containing the edge arrival time functions, can also be a named pipe or /dev/stdin.")
+                    ("binary,b", "edgegraph is in the packed binary format of FSIPP.write(file, binary=True)")
                     ("search,s", po::value<std::string>()->default_value("repeat"), "Search algorithm to use")
                     ("startTime,t", po::value<double>()->default_value(0.0), "Start Time of search.")
                     ("searchDuration,d", po::value<double>()->default_value(900.0), "Maximum duration of search.")
@@ -31,11 +32,14 @@ int main(int argc, char* argv[]) {
             if (vm.count("help")) {
                 std::cout << desc << std::endl;
             } else if (vm.count("edgegraph") &&
-                       std::filesystem::is_regular_file(vm["edgegraph"].as<std::filesystem::path>())) {
+                       (std::filesystem::is_regular_file(vm["edgegraph"].as<std::filesystem::path>()) ||
+                        // Allows streaming the graph through a named pipe or /dev/stdin
+                        std::filesystem::is_fifo(vm["edgegraph"].as<std::filesystem::path>()))) {
                 Location source_loc(vm["start"].as<std::string>());
                 Location goal_loc(vm["goal"].as<std::string>());
 
-                Graph g = read_graph(vm["edgegraph"].as<std::filesystem::path>().string());
+                Graph g = vm.count("binary") ? read_graph_binary(vm["edgegraph"].as<std::filesystem::path>().string())
+                                             : read_graph(vm["edgegraph"].as<std::filesystem::path>().string());
 
                 bool foundStart = false;
                 bool foundGoal = false;
@@ -1,6 +1,10 @@
+import argparse
 import json
+import logging
+from typing import Optional
 
 from .railways.block_graph import BlockGraph
+from .railways.graph_cache import load_graph, clear_cache, default_cache_dir, cache_enabled
 from .railways.scenario import Scenario
 from .railways.track_graph import TrackGraph
 from .railways.train_agent import TrainAgent
@@ -8,9 +12,20 @@ from .util.types import GraphType
 
 # TODO: discuss if we want this file, or keep TrackGraph and BlockGraph (railway specific classes) to the experiment files
 
-def graph_from_file(file) -> BlockGraph:
+def graph_from_file(file, use_cache: Optional[bool] = None, cache_dir: Optional[str] = None,
+                    workers: Optional[int] = 1) -> BlockGraph:
+    """
+    @param use_cache: Read the graph from the cache if the location file was read before, see graph_cache.
+    By default the cache is only used if cache_dir is given or $FLEXSIPP_CACHE_DIR is set.
+    @param cache_dir: Directory of the cache, default_cache_dir() if not given
+    @param workers: Number of processes that create the block graph, see BlockGraph.from_track_graph
+    """
+    if use_cache is None:
+        use_cache = cache_dir is not None or cache_enabled()
+    if use_cache:
+        return load_graph(file, cache_dir, workers)
     track_graph = TrackGraph.read_graph(file)
-    block_graph = BlockGraph.from_track_graph(track_graph)
+    block_graph = BlockGraph.from_track_graph(track_graph, workers)
     return block_graph
 
 def scenario_from_file(file, graph: GraphType, agent_cls=TrainAgent):
@@ -18,3 +33,28 @@ def scenario_from_file(file, graph: GraphType, agent_cls=TrainAgent):
         data = json.load(f)
     scenario = Scenario(data, graph, agent_cls)
     return scenario
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the block graph of a location and store it in the cache")
+    parser.add_argument("location", nargs="?", help="Location json file")
+    parser.add_argument("--cache-dir", default=None, help=f"Cache directory (default: {default_cache_dir()})")
+    parser.add_argument("--no-cache", action="store_true", help="Create the graph without using the cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Remove all cached graphs first")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes that create the block graph, 0 for the number of CPUs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.clear_cache:
+        print(f"Removed {clear_cache(args.cache_dir)} cached graphs")
+    if args.location is not None:
+        g = graph_from_file(args.location, use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                            workers=args.workers or None)
+        print(f"{args.location}: {len(g.tg.nodes)} tracks, {len(g.nodes)} blocks and {len(g.edges)} block edges")
+    elif not args.clear_cache:
+        parser.error("a location is required unless --clear-cache is given")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from .binary_edge_graph import ATF_DTYPE
+from .unsafe_intervals import _agent_id
+from ..util.intervals import SafeInterval
+
+Connection = Tuple[SafeInterval, SafeInterval, SafeInterval, float]
+
+# Values of a connection that the ATF is calculated from, one row per connection
+_CONNECTION_COLUMNS = ("from_start", "from_end", "edge_start", "edge_end", "to_start", "to_end", "delta",
+                       "from_id", "to_id", "train_before", "crt_before", "train_after", "buffer_after", "crt_after")
+
+
+def connection_values(connections: list[Connection]) -> np.ndarray:
+    """
+    @return: connections x _CONNECTION_COLUMNS matrix
+    """
+    return np.array([(f.start, f.end, e.start, e.end, t.start, t.end, delta, f.index, t.index,
+                      _agent_id(e.agent_before), e.crt_before, _agent_id(e.agent_after), e.buffer_after, e.crt_after)
+                     for f, e, t, delta in connections], dtype=np.float64).reshape(-1, len(_CONNECTION_COLUMNS))
+
+
+def alpha_beta(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the ATFs of connection_values at once, see ArrivalTimeFunction.
+    @return: alpha, beta and whether the ATF is valid (zeta <= alpha < beta) per connection
+    """
+    from_start, from_end, edge_start, edge_end, to_start, to_end, delta = values[:, :7].T
+    alpha = np.maximum(np.maximum(from_start, edge_start), to_start - delta)
+    beta = np.minimum(np.minimum(from_end, edge_end), to_end - delta)
+    return alpha, beta, (from_start <= alpha) & (alpha < beta)
+
+
+class ATFRow(object):
+    """
+    View of a single ATF in an ATFTable, with the attributes of FlexibleArrivalTimeFunction.
+    The trains are given by their id instead of an Agent.
+    """
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: "ATFTable", row: int):
+        self.table = table
+        self.row = row
+
+    def __getattr__(self, item):
+        if item in ATF_DTYPE.names:
+            return getattr(self.table, item)[self.row].item()
+        raise AttributeError(item)
+
+    def __bool__(self) -> bool:
+        return self.zeta <= self.alpha < self.beta
+
+    def __repr__(self):
+        return " ".join(str(getattr(self, column)) for column in ATF_DTYPE.names)
+
+
+class ATFTable(object):
+    """
+    Struct-of-arrays version of a list of FlexibleArrivalTimeFunctions, with one typed NumPy array per column
+    (the fields of ATF_DTYPE). Indexing with an int gives an ATFRow, indexing with a slice or mask gives a new table.
+    """
+    def __init__(self, **columns: np.ndarray):
+        for column in ATF_DTYPE.names:
+            setattr(self, column, np.asarray(columns[column], dtype=ATF_DTYPE[column].newbyteorder("=")))
+
+    @classmethod
+    def empty(cls) -> "ATFTable":
+        return cls(**{column: np.empty(0) for column in ATF_DTYPE.names})
+
+    @classmethod
+    def from_connections(cls, connections: list[Connection], heuristics: Union[list[float], np.ndarray]) -> "ATFTable":
+        """
+        Create the ATFs of the valid connections.
+        @param connections: (from interval, edge interval, to interval, delta) tuples, see Node.get_safe_connections
+        @param heuristics: Heuristic per connection
+        """
+        return cls.from_connection_values(connection_values(connections), heuristics)
+
+    @classmethod
+    def from_connection_values(cls, values: np.ndarray, heuristics: Union[list[float], np.ndarray],
+                               atfs: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> "ATFTable":
+        """
+        Same as from_connections, with the values of the connections given by connection_values.
+        @param atfs: alpha_beta(values), if it is already calculated
+        """
+        alpha, beta, valid = alpha_beta(values) if atfs is None else atfs
+        values = values[valid]
+        columns = dict(zip(_CONNECTION_COLUMNS, values.T))
+        # The buffer and crt are taken from the edge interval
+        return cls(from_id=columns["from_id"], to_id=columns["to_id"], zeta=columns["from_start"],
+                   alpha=alpha[valid], beta=beta[valid], delta=columns["delta"],
+                   train_before=columns["train_before"], crt_before=columns["crt_before"],
+                   train_after=columns["train_after"], buffer_after=columns["buffer_after"],
+                   crt_after=columns["crt_after"], heuristic=np.asarray(heuristics, dtype=np.float64)[valid])
+
+    @classmethod
+    def concatenate(cls, tables: Iterable["ATFTable"]) -> "ATFTable":
+        tables = list(tables)
+        if not tables:
+            return cls.empty()
+        return cls(**{column: np.concatenate([getattr(t, column) for t in tables]) for column in ATF_DTYPE.names})
+
+    def __len__(self):
+        return len(self.from_id)
+
+    def __getitem__(self, item) -> Union[ATFRow, "ATFTable"]:
+        if isinstance(item, (int, np.integer)):
+            if not -len(self) <= item < len(self):
+                raise IndexError(item)
+            return ATFRow(self, item % len(self))
+        return ATFTable(**{column: getattr(self, column)[item] for column in ATF_DTYPE.names})
+
+    def __iter__(self) -> Iterator[ATFRow]:
+        return (ATFRow(self, i) for i in range(len(self)))
+
+    def num_trains(self) -> int:
+        """
+        @return: Highest train id in the table, 0 if there are none
+        """
+        if len(self) == 0:
+            return 0
+        return max(int(self.train_before.max()), int(self.train_after.max()), 0)
+
+    def records(self, interval_index_map: Optional[dict[int, int]] = None) -> np.ndarray:
+        """
+        @param interval_index_map: Replace the from and to ids with the mapped ids, like replace_index
+        @return: The table as packed ATF_DTYPE records
+        """
+        records = np.empty(len(self), dtype=ATF_DTYPE)
+        for column in ATF_DTYPE.names:
+            records[column] = getattr(self, column)
+        if interval_index_map is not None and len(self) > 0:
+            lookup = np.full(max(interval_index_map, default=-1) + 1, -1, dtype=np.int64)
+            lookup[list(interval_index_map.keys())] = list(interval_index_map.values())
+            records["from_id"] = lookup[self.from_id]
+            records["to_id"] = lookup[self.to_id]
+        return records
+
+    def lines(self, interval_index_map: Optional[dict[int, int]] = None) -> Iterator[str]:
+        """
+        @param interval_index_map: Replace the from and to ids with the mapped ids, like replace_index
+        @return: One line per ATF in the format of the edge graph (the repr of FlexibleArrivalTimeFunction)
+        """
+        records = self.records(interval_index_map)
+        for row in zip(*(records[column].tolist() for column in ATF_DTYPE.names)):
+            yield " ".join(map(str, row)) + "\n"
+
+    def __repr__(self):
+        return f"ATFTable with {len(self)} ATFs"
@@ -0,0 +1,100 @@
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO
+
+import numpy as np
+
+MAGIC = b"FSIPPBIN"
+VERSION = 1
+
+# magic, version, reserved, number of names, vertices, edges and trains
+HEADER = struct.Struct("<8sIIqqqq")
+
+# Packed little-endian records, these layouts have to match read_graph_binary in search/graph.cpp
+VERTEX_DTYPE = np.dtype([
+    ("name", "<i4"),
+    ("start", "<f8"),
+    ("end", "<f8"),
+    ("agent_before", "<i4"),
+    ("crt_before", "<f8"),
+    ("agent_after", "<i4"),
+    ("buffer_after", "<f8"),
+    ("crt_after", "<f8"),
+])
+
+ATF_DTYPE = np.dtype([
+    ("from_id", "<i8"),
+    ("to_id", "<i8"),
+    ("zeta", "<f8"),
+    ("alpha", "<f8"),
+    ("beta", "<f8"),
+    ("delta", "<f8"),
+    ("train_before", "<i4"),
+    ("crt_before", "<f8"),
+    ("train_after", "<i4"),
+    ("buffer_after", "<f8"),
+    ("crt_after", "<f8"),
+    ("heuristic", "<f8"),
+])
+
+
+@dataclass
+class BinaryEdgeGraph:
+    """
+    Edge graph in the packed binary format that is read by flexsipp.exe --binary.
+    vertices["name"] indexes names, atfs["from_id"] and atfs["to_id"] index vertices.
+    """
+    names: list[str]
+    vertices: np.ndarray
+    atfs: np.ndarray
+    num_trains: int
+
+    def write(self, f: BinaryIO):
+        """
+        Layout: header, name offsets (int64, number of names + 1), utf-8 names, vertex records and ATF records.
+        """
+        encoded = [name.encode("utf-8") for name in self.names]
+        offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
+
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(self.names), len(self.vertices), len(self.atfs), self.num_trains))
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+        f.flush()
+        # tofile needs a real file, fall back to writing the bytes for other streams
+        for records, dtype in ((self.vertices, VERTEX_DTYPE), (self.atfs, ATF_DTYPE)):
+            records = np.ascontiguousarray(records, dtype=dtype)
+            try:
+                records.tofile(f)
+            except (OSError, ValueError, AttributeError):
+                f.write(records.tobytes())
+
+    def vertex_names(self) -> list[str]:
+        return [self.names[i] for i in self.vertices["name"].tolist()]
+
+
+def read_binary_edge_graph(file) -> BinaryEdgeGraph:
+    """
+    Read an edge graph written by FSIPP.write(file, binary=True).
+    @param file: Path of the file
+    @return: Names, vertex records, ATF records and the number of trains
+    """
+    with open(file, "rb") as f:
+        data = f.read()
+    magic, version, _, n_names, n_vertices, n_edges, num_trains = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{file} is not a binary edge graph")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary edge graph version {version}")
+
+    position = HEADER.size
+    offsets = np.frombuffer(data, dtype="<i8", count=n_names + 1, offset=position)
+    position += offsets.nbytes
+    blob = data[position:position + int(offsets[-1])]
+    names = [blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    position += len(blob)
+
+    vertices = np.frombuffer(data, dtype=VERTEX_DTYPE, count=n_vertices, offset=position)
+    position += vertices.nbytes
+    atfs = np.frombuffer(data, dtype=ATF_DTYPE, count=n_edges, offset=position)
+    return BinaryEdgeGraph(names, vertices, atfs, num_trains)
@@ -0,0 +1,80 @@
+import heapq
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    from scipy.sparse import csgraph, csr_matrix
+except ImportError:
+    csgraph = None
+
+from .frozen_graph import FrozenGraph
+
+
+def dijkstra(fg: FrozenGraph, source: int, agent_velocity: Optional[float] = None, target: Optional[int] = None,
+             predecessors=False, reverse=False) -> Tuple[list[float], Optional[list[int]]]:
+    """
+    Dijkstra search over the CSR arrays of a frozen graph.
+    @param fg: Frozen graph to search in
+    @param source: Index of the node to start from
+    @param agent_velocity: Maximum velocity of the agent, or None to use the edge length as weight
+    @param target: Stop as soon as this node index is settled, search the entire graph if None
+    @param predecessors: Also keep track of the edge id leading to every node
+    @param reverse: Search backwards over the incoming edges
+    @return: Distance per node index (inf if not reached), and the predecessor edge id per node index (-1 if none)
+    """
+    offsets, neighbours, edge_ids = fg.adjacency_lists(reverse)
+    weights = fg.weight_list(agent_velocity)
+    distances = [math.inf] * fg.n_nodes
+    previous_edge = [-1] * fg.n_nodes if predecessors else None
+    distances[source] = 0.0
+    pq = [(0.0, source)]
+    while pq:
+        d, u = heapq.heappop(pq)
+        if d > distances[u]:
+            continue
+        if u == target:
+            break
+        for i in range(offsets[u], offsets[u + 1]):
+            e = edge_ids[i]
+            tmp = d + weights[e]
+            v = neighbours[i]
+            if tmp < distances[v]:
+                distances[v] = tmp
+                if previous_edge is not None:
+                    previous_edge[v] = e
+                heapq.heappush(pq, (tmp, v))
+    return distances, previous_edge
+
+
+def multi_source_distances(fg: FrozenGraph, sources: list[int], agent_velocity: Optional[float] = None,
+                           reverse=False) -> np.ndarray:
+    """
+    Distances from several sources at once.
+    Uses the sparse shortest path routine of SciPy when it is installed, and the heapq search otherwise.
+    @param fg: Frozen graph to search in
+    @param sources: Indices of the nodes to start from
+    @param agent_velocity: Maximum velocity of the agent, or None to use the edge length as weight
+    @param reverse: Search backwards over the incoming edges
+    @return: sources x nodes matrix with the distances (inf if not reached)
+    """
+    if len(sources) == 0:
+        return np.empty((0, fg.n_nodes))
+    if csgraph is None:
+        return np.array([dijkstra(fg, source, agent_velocity, reverse=reverse)[0] for source in sources])
+
+    rows, cols = (fg.edge_to, fg.edge_from) if reverse else (fg.edge_from, fg.edge_to)
+    weights = fg.weights(agent_velocity)
+    # Only keep the shortest of parallel edges, a sparse matrix would otherwise sum them
+    order = np.lexsort((weights, cols, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, weights = rows[first], cols[first], weights[first]
+
+    indptr = np.zeros(fg.n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=fg.n_nodes), out=indptr[1:])
+    # Explicit zeros are kept as edges by csgraph, which is needed for the zero length edges
+    matrix = csr_matrix((weights, cols, indptr), shape=(fg.n_nodes, fg.n_nodes))
+    return csgraph.dijkstra(matrix, directed=True, indices=sources)
@@ -0,0 +1,48 @@
+import sys
+from logging import getLogger
+from typing import Generic, Iterable
+
+from .graph import Graph
+from ..util.types import EdgeType, NodeType
+
+logger = getLogger('__main__.' + __name__)
+
+
+class DistanceOracle(Generic[EdgeType, NodeType]):
+    """
+    Precomputed time-distances between a fixed set of terminal nodes (e.g. the station platforms of a location).
+    The distances are calculated once per agent velocity, after which every query is a dictionary lookup.
+    """
+    def __init__(self, g: Graph[EdgeType, NodeType], terminals: Iterable[NodeType]):
+        self.g = g
+        self.terminals: set[str] = {t.name for t in terminals}
+        # velocity -> source name -> target name -> time-distance
+        self.distances: dict[float, dict[str, dict[str, float]]] = {}
+
+    def __contains__(self, node: NodeType) -> bool:
+        return node.name in self.terminals
+
+    def build(self, agent_velocity):
+        """
+        Calculate the distances between all terminals for the given velocity.
+        @param agent_velocity: Maximum velocity of the agent
+        """
+        for source in self.terminals:
+            self._row(source, agent_velocity)
+
+    def _row(self, source: str, agent_velocity) -> dict[str, float]:
+        rows = self.distances.setdefault(agent_velocity, {})
+        if source not in rows:
+            time_distances = self.g.calculate_distances(self.g.nodes[source], agent_velocity)
+            rows[source] = {t: time_distances[t] for t in self.terminals}
+            logger.debug(f"Calculated distances from {source} with velocity {agent_velocity}")
+        return rows[source]
+
+    def distance(self, start: NodeType, end: NodeType, agent_velocity) -> float:
+        """
+        @return: Shortest time-distance from start to end, sys.maxsize if end can not be reached
+        """
+        return self._row(start.name, agent_velocity).get(end.name, sys.maxsize)
+
+    def clear(self):
+        self.distances.clear()
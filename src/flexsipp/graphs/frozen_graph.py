@@ -0,0 +1,90 @@
+from typing import Generic, Optional
+
+import numpy as np
+
+from ..util.types import EdgeType, NodeType
+
+
+def _csr(sources: np.ndarray, n_nodes: int):
+    """
+    @return: CSR offsets and the edge ids sorted by source node (stable, so in the order of Node.outgoing/incoming)
+    """
+    order = np.argsort(sources, kind="stable").astype(np.int32)
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=offsets[1:])
+    return offsets, order
+
+
+class FrozenGraph(Generic[EdgeType, NodeType]):
+    """
+    Immutable array-backed snapshot of the topology of a Graph, created by Graph.freeze().
+    Node i is nodes[i], edge i is edges[i]. The outgoing edges of node u are
+    out_edges[out_offsets[u]:out_offsets[u + 1]], the incoming edges are in_edges[in_offsets[u]:in_offsets[u + 1]].
+    """
+    def __init__(self, nodes: dict[str, NodeType], edges: list[EdgeType]):
+        self.nodes: tuple[NodeType, ...] = tuple(nodes.values())
+        self.edges: tuple[EdgeType, ...] = tuple(edges)
+        self.index: dict[str, int] = {name: i for i, name in enumerate(nodes)}
+
+        self.edge_from = np.fromiter((self.index[e.from_node.name] for e in edges), dtype=np.int32, count=len(edges))
+        self.edge_to = np.fromiter((self.index[e.to_node.name] for e in edges), dtype=np.int32, count=len(edges))
+        self.length = np.fromiter((e.length for e in edges), dtype=np.float64, count=len(edges))
+        self.max_speed = np.fromiter((e.max_speed for e in edges), dtype=np.float64, count=len(edges))
+
+        self.out_offsets, self.out_edges = _csr(self.edge_from, len(self.nodes))
+        self.in_offsets, self.in_edges = _csr(self.edge_to, len(self.nodes))
+
+        for array in (self.edge_from, self.edge_to, self.length, self.max_speed,
+                      self.out_offsets, self.out_edges, self.in_offsets, self.in_edges):
+            array.flags.writeable = False
+
+        self._weights: dict[Optional[float], np.ndarray] = {}
+        self._weight_lists: dict[Optional[float], list[float]] = {}
+        self._lists: dict[bool, tuple[list[int], list[int], list[int]]] = {}
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edges)
+
+    def names(self) -> list[str]:
+        return [n.name for n in self.nodes]
+
+    def weights(self, agent_velocity: Optional[float] = None) -> np.ndarray:
+        """
+        @param agent_velocity: Maximum velocity of the agent, or None to use the edge length as weight
+        @return: Weight per edge id, time-distances if agent_velocity is given
+        """
+        if agent_velocity not in self._weights:
+            if agent_velocity is None:
+                weights = self.length
+            else:
+                weights = self.length / np.minimum(self.max_speed, agent_velocity)
+                weights.flags.writeable = False
+            self._weights[agent_velocity] = weights
+        return self._weights[agent_velocity]
+
+    def weight_list(self, agent_velocity: Optional[float] = None) -> list[float]:
+        """
+        Python list version of weights(agent_velocity).
+        """
+        if agent_velocity not in self._weight_lists:
+            self._weight_lists[agent_velocity] = self.weights(agent_velocity).tolist()
+        return self._weight_lists[agent_velocity]
+
+    def adjacency_lists(self, reverse=False) -> tuple[list[int], list[int], list[int]]:
+        """
+        Python list version of the CSR arrays, for loops that access single elements.
+        @param reverse: Use the incoming instead of the outgoing edges
+        @return: offsets, neighbour per CSR entry and edge id per CSR entry
+        """
+        if reverse not in self._lists:
+            if reverse:
+                offsets, edge_ids, neighbours = self.in_offsets, self.in_edges, self.edge_from
+            else:
+                offsets, edge_ids, neighbours = self.out_offsets, self.out_edges, self.edge_to
+            self._lists[reverse] = (offsets.tolist(), neighbours[edge_ids].tolist(), edge_ids.tolist())
+        return self._lists[reverse]
@@ -1,67 +1,405 @@
+import asyncio
+import contextlib
+import heapq
+import io
+import math
+import os
 import subprocess
+import tempfile
+import threading
 from logging import getLogger
-from typing import Generic
+from typing import Generic, Union, Iterator, Optional, Iterable, Tuple, Any
 
-from .graph import Graph
-from ..util.intervals import SafeInterval, FlexibleArrivalTimeFunction
-from ..util.results import Results
+import numpy as np
+
+from .atf_table import ATFTable, alpha_beta, connection_values
+from .binary_edge_graph import BinaryEdgeGraph, VERTEX_DTYPE
+from .graph import Graph, IntervalStore
+from .graph_view import GraphView, NodeView
+from .unsafe_intervals import _agent_id
+from ..util.intervals import SafeInterval
+from ..util.results import Results, ResultsParser
 from ..util.types import EdgeType, NodeType
 
 logger = getLogger('__main__.' + __name__)
 
+# Number of characters of the edge graph that are written to a search process at once
+STREAM_CHUNK_SIZE = 1 << 16
+# Longest line of the search output that is read, the compound ATF is on a single line
+STREAM_LINE_LIMIT = 1 << 26
+# The edge graph is streamed to the search through its stdin if this exists, see FSIPP.run_search_async
+STDIN = "/dev/stdin"
+
+
+def relevant_nodes(g: Union[Graph[EdgeType, NodeType], GraphView[EdgeType, NodeType]], origin: str, destination: str):
+    """
+    @return: The nodes of g (name to node, in the order of g.nodes) that can be reached from origin and from which
+    destination can be reached, other nodes can never be part of a path from origin to destination.
+    """
+    def reachable(start, neighbours) -> set[str]:
+        seen = {start.name}
+        stack = [start]
+        while stack:
+            for n in neighbours(stack.pop()):
+                if n.name not in seen:
+                    seen.add(n.name)
+                    stack.append(n)
+        return seen
+
+    forward = reachable(g.nodes[origin], lambda n: (e.to_node for e in n.outgoing))
+    backward = reachable(g.nodes[destination], lambda n: (e.from_node for e in n.incoming))
+    nodes = {name: node for name, node in g.nodes.items() if name in forward and name in backward}
+    if not nodes:
+        logger.warning(f"{destination} can not be reached from {origin}")
+    return nodes
+
 
 class FSIPP(Generic[EdgeType, NodeType]):
-    def __init__(self, g:Graph[EdgeType, NodeType], heuristic):
-        g.invert_unsafe_intervals()
-        self.atfs: list[FlexibleArrivalTimeFunction] = []
+    def __init__(self, g: Union[Graph[EdgeType, NodeType], GraphView[EdgeType, NodeType]], heuristic,
+                 origin: Optional[str] = None, destination: Optional[str] = None):
+        """
+        @param origin: Name of the node the search starts from, see destination
+        @param destination: Name of the goal node of the search. If both origin and destination are given, only the
+        nodes that are on some path from origin to destination are part of the FSIPP graph, and only their safe
+        intervals are calculated (a GraphView calculates them on first access)
+        """
         self.g = g
+        self.heuristic = heuristic
+        if origin is None or destination is None:
+            self.nodes: dict[str, NodeType] = g.nodes
+            g.invert_unsafe_intervals()
+        else:
+            self.nodes = relevant_nodes(g, origin, destination)
+            g.invert_unsafe_intervals(list(self.nodes.values()) +
+                                      [e for n in self.nodes.values() for e in self._outgoing(n)])
 
-        for node in g.nodes.values():
-            def create_atf(from_interval: SafeInterval, edge_interval: SafeInterval, to_interval: SafeInterval, delta):
-                h = heuristic[node.name] if node.name in heuristic else 0
-                flex_atf = FlexibleArrivalTimeFunction(from_interval, edge_interval, to_interval, delta, h)
-                if flex_atf:
-                    self.atfs.append(flex_atf)
-            [create_atf(*c) for c in node.get_safe_connections()]
-
-    def write(self, file):
-        with open(file, 'wt') as f:
-            f.write(f"vertex count: {str(len([x for node in self.g.nodes.values() for x in node.safe_intervals]))}\n")
-            f.write(f"edge count: {str(len(self.atfs))}\n")
-
-            # Create an index map that maps the safe interval index (in any arbitrary range) to an index starting from 0.
-            interval_index_map: dict[int, int] = {}
-            last_index = 0
-
-            for node in self.g.nodes.values():
-                for interval in node.safe_intervals:
-                    f.write(f"{node.name} {repr(interval)}\n")
-                    interval_index_map[interval.index] = last_index
-                    last_index += 1
-
-            num_trains = 0
-            for atf in self.atfs:
-                # TODO: recreate atfs such that from_id and to_id start at 0 (or 1?), also for agents
-                atf = atf.replace_index(interval_index_map)
-                f.write(f"{repr(atf)}\n")
-                num_trains = max(num_trains, atf.train_before.id, atf.train_after.id)
-            f.write(f"num_trains {num_trains}\n")
-
-    def run_search(self, timeout, origin, destination, start_time, file="flexsipp.txt") -> Results:
-        self.write(file)
-        try:
-            proc = subprocess.run(["flexsipp.exe",
-                                   "--start", str(origin),
-                                   "--goal", str(destination),
-                                   "--edgegraph", str(file),
-                                   "--search", "repeat",
-                                   "--startTime", str(start_time)
-                                   ], timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
-                                  encoding='utf-8')
-        except subprocess.TimeoutExpired:
+        # ATFs per from node, in the order of self.nodes
+        self._node_atfs: dict[str, ATFTable] = self._create_atfs(self.nodes.values())
+        self.atfs: ATFTable = ATFTable.concatenate(self._node_atfs.values())
+
+        # Arguments of prune_corridor and the safe intervals per node and ATFs that are exported, None if not pruned
+        self._corridor_arguments: Optional[Tuple[str, float, Optional[float]]] = None
+        self._corridor: Optional[Tuple[dict[str, list[SafeInterval]], ATFTable]] = None
+
+    def _create_atfs(self, nodes: Iterable[NodeType]) -> dict[str, ATFTable]:
+        connections: list[Tuple[SafeInterval, SafeInterval, SafeInterval, float]] = []
+        heuristics: list[float] = []
+        owners: list[int] = []
+        names: list[str] = []
+        for node in nodes:
+            node_connections = node.get_safe_connections(self._outgoing(node))
+            connections.extend(node_connections)
+            heuristics.extend([self.heuristic[node.name] if node.name in self.heuristic else 0] * len(node_connections))
+            owners.extend([len(names)] * len(node_connections))
+            names.append(node.name)
+
+        # Only the connections that can be traversed are in the table, the ATFs of a node are consecutive
+        values = connection_values(connections)
+        atfs = alpha_beta(values)
+        valid = atfs[2]
+        table = ATFTable.from_connection_values(values, heuristics, atfs)
+        offsets = np.searchsorted(np.asarray(owners, dtype=np.int64)[valid], np.arange(len(names) + 1))
+        return {name: table[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}
+
+    def _outgoing(self, node: NodeType) -> list[EdgeType]:
+        return [e for e in node.outgoing if e.to_node.name in self.nodes]
+
+    def update(self, changed: Iterable[IntervalStore]):
+        """
+        Patch the FSIPP graph after the unsafe intervals or flexibility of some nodes/edges changed, see
+        Scenario.update_agent. Only the safe intervals of the changed nodes/edges are calculated again, and only the
+        ATFs that start at a changed node, at the from node of a changed edge or at a node before a changed node.
+        Requires the FSIPP graph to be created from a GraphView.
+        @param changed: Changed nodes/edges of the graph the view is based on
+        """
+        assert isinstance(self.g, GraphView), "Only FSIPP graphs of a GraphView can be updated"
+        dirty_nodes: set[str] = set()
+        for view in self.g.update(changed):
+            if isinstance(view, NodeView):
+                dirty_nodes.add(view.name)
+                dirty_nodes.update(e.from_node.name for e in view.incoming)
+            else:
+                dirty_nodes.add(view.from_node.name)
+        self._node_atfs.update(self._create_atfs(node for name, node in self.nodes.items() if name in dirty_nodes))
+        self.atfs = ATFTable.concatenate(self._node_atfs.values())
+        if self._corridor_arguments is not None:
+            self.prune_corridor(*self._corridor_arguments)
+
+    def time_distances(self, origin: str) -> dict[str, float]:
+        """
+        @return: Shortest time-distance (sum of the edge lengths, which are in time) from origin to the nodes of the
+        FSIPP graph that can be reached.
+        """
+        distances = {origin: 0.0}
+        pq = [(0.0, origin)]
+        while pq:
+            d, name = heapq.heappop(pq)
+            if d > distances[name]:
+                continue
+            for e in self._outgoing(self.nodes[name]):
+                tmp = d + e.length
+                if tmp < distances.get(e.to_node.name, math.inf):
+                    distances[e.to_node.name] = tmp
+                    heapq.heappush(pq, (tmp, e.to_node.name))
+        return distances
+
+    def prune_corridor(self, origin: str, start_time: float, latest_arrival: Optional[float] = None):
+        """
+        Leave out the safe intervals and ATFs that can not be part of a plan from origin departing at start_time or
+        later from the exported edge graph (lines, write and run_search). A safe interval of a node is left out if
+        it ends (including its buffer time) before the earliest time the node can be reached, which is start_time
+        plus the time-distance from origin. With latest_arrival, intervals and ATFs from which the destination can
+        only be reached after latest_arrival according to the heuristic are left out as well.
+        The ATFs of the FSIPP graph itself are not changed, the corridor is calculated again after update.
+        @param origin: Name of the node the search starts from
+        @param start_time: Start time of the search
+        @param latest_arrival: Latest arrival time at the destination to keep plans for, no upper bound if None
+        """
+        self._corridor_arguments = (origin, start_time, latest_arrival)
+        earliest = {name: start_time + d for name, d in self.time_distances(origin).items()}
+
+        def heuristic(name: str) -> float:
+            return self.heuristic[name] if name in self.heuristic else 0
+
+        def too_late(name: str, start: float) -> bool:
+            return latest_arrival is not None and start + heuristic(name) > latest_arrival
+
+        intervals: dict[str, list[SafeInterval]] = {}
+        # Per safe interval id: whether it is kept, and the earliest time and heuristic of its node
+        n_ids = max([si.index for node in self.nodes.values() for si in node.safe_intervals] +
+                    self.atfs.from_id.tolist() + self.atfs.to_id.tolist(), default=-1) + 1
+        kept = np.zeros(n_ids, dtype=bool)
+        earliest_at = np.full(n_ids, math.inf)
+        heuristic_at = np.zeros(n_ids)
+        for name, node in self.nodes.items():
+            if name not in earliest:
+                intervals[name] = []
+                continue
+            intervals[name] = [interval for interval in node.safe_intervals
+                               if interval.end + interval.buffer_after >= earliest[name] and
+                               not too_late(name, interval.start)]
+            ids = [interval.index for interval in intervals[name]]
+            kept[ids] = True
+            earliest_at[ids] = earliest[name]
+            heuristic_at[ids] = heuristic(name)
+
+        atfs = self.atfs
+        mask = kept[atfs.from_id] & kept[atfs.to_id] & (atfs.beta + atfs.buffer_after >= earliest_at[atfs.from_id])
+        if latest_arrival is not None:
+            mask &= atfs.alpha + atfs.delta + heuristic_at[atfs.to_id] <= latest_arrival
+        atfs = atfs[mask]
+        logger.debug(f"Corridor from {origin} at {start_time} keeps {int(kept.sum())} safe intervals "
+                     f"and {len(atfs)} of {len(self.atfs)} ATFs")
+        self._corridor = (intervals, atfs)
+
+    def _export(self) -> Tuple[dict[str, list[SafeInterval]], ATFTable]:
+        """
+        @return: The safe intervals per node and the ATFs of the edge graph that is given to the search
+        """
+        if self._corridor is not None:
+            return self._corridor
+        return {name: node.safe_intervals for name, node in self.nodes.items()}, self.atfs
+
+    def lines(self) -> Iterator[str]:
+        """
+        Generate the edge graph that is read by the search, line by line.
+        """
+        intervals, atfs = self._export()
+        yield f"vertex count: {str(sum(len(node_intervals) for node_intervals in intervals.values()))}\n"
+        yield f"edge count: {str(len(atfs))}\n"
+
+        # Create an index map that maps the safe interval index (in any arbitrary range) to an index starting from 0.
+        interval_index_map: dict[int, int] = {}
+        last_index = 0
+
+        for name, node_intervals in intervals.items():
+            for interval in node_intervals:
+                yield f"{name} {repr(interval)}\n"
+                interval_index_map[interval.index] = last_index
+                last_index += 1
+
+        # TODO: recreate atfs such that from_id and to_id start at 0 (or 1?), also for agents
+        yield from atfs.lines(interval_index_map)
+        yield f"num_trains {atfs.num_trains()}\n"
+
+    def binary_edge_graph(self) -> BinaryEdgeGraph:
+        """
+        Create the edge graph as fixed-width records, with the same content as lines().
+        """
+        intervals, atfs = self._export()
+        names: list[str] = []
+        vertices = []
+        interval_index_map: dict[int, int] = {}
+        for name, node_intervals in intervals.items():
+            name_id = len(names)
+            names.append(name)
+            for interval in node_intervals:
+                interval_index_map[interval.index] = len(vertices)
+                vertices.append((name_id, interval.start, interval.end,
+                                 _agent_id(interval.agent_before), interval.crt_before,
+                                 _agent_id(interval.agent_after), interval.buffer_after, interval.crt_after))
+
+        return BinaryEdgeGraph(names, np.array(vertices, dtype=VERTEX_DTYPE), atfs.records(interval_index_map),
+                               atfs.num_trains())
+
+    def write(self, file, binary=False):
+        """
+        @param binary: Write the packed binary format (read with flexsipp.exe --binary) instead of text
+        """
+        if binary:
+            with open(file, 'wb') as f:
+                self.binary_edge_graph().write(f)
+        else:
+            with open(file, 'wt') as f:
+                f.writelines(self.lines())
+
+    @staticmethod
+    def _search_command(origin, destination, file, start_time, binary=False) -> list[str]:
+        return ["flexsipp.exe",
+                "--start", str(origin),
+                "--goal", str(destination),
+                "--edgegraph", str(file),
+                "--search", "repeat",
+                "--startTime", str(start_time)
+                ] + (["--binary"] if binary else [])
+
+    def run_search(self, timeout, origin, destination, start_time, file="flexsipp.txt", binary=False) -> Results:
+        """
+        Run the search and parse its output while it is being written, the output is never kept in memory as a whole.
+        """
+        self.write(file, binary)
+        with subprocess.Popen(self._search_command(origin, destination, file, start_time, binary),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8') as proc:
+            timed_out = threading.Event()
+
+            def kill():
+                timed_out.set()
+                proc.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+            try:
+                results = Results.from_lines(proc.stdout)
+            except (ValueError, IndexError, StopIteration):
+                # Incomplete output, the search was killed or failed
+                results = None
+            finally:
+                proc.stdout.read()
+                proc.wait()
+                timer.cancel()
+        if timed_out.is_set() and proc.returncode != 0:
             logger.error(f'Timeout for repeat ({timeout}s) expired')
             raise RuntimeError
-        if int(proc.returncode) != 0:
+        if int(proc.returncode) != 0 or results is None:
+            logger.error(f'Search failed for repeat, ec: {proc.returncode}')
+            raise RuntimeError
+        return results
+
+    async def run_search_async(self, timeout, origin, destination, start_time,
+                               limit: Optional[asyncio.Semaphore] = None, binary=False) -> Results:
+        """
+        Run the search in a subprocess without blocking the event loop. The edge graph is streamed to the stdin of
+        the search instead of being written to a file first, so writing the graph of one search overlaps with
+        other searches that are running. Without /dev/stdin the graph is written to a temporary file instead.
+        @param limit: Semaphore limiting the number of searches that run at the same time
+        @param binary: Give the edge graph to the search in the packed binary format instead of text
+        """
+        async with limit if limit is not None else contextlib.nullcontext():
+            stream = os.path.exists(STDIN)
+            with contextlib.ExitStack() as stack:
+                if stream:
+                    file = STDIN
+                else:
+                    directory = stack.enter_context(tempfile.TemporaryDirectory())
+                    file = os.path.join(directory, "flexsipp.bin" if binary else "flexsipp.txt")
+                    await asyncio.to_thread(self.write, file, binary)
+                command = self._search_command(origin, destination, file, start_time, binary)
+                stdin = asyncio.subprocess.PIPE if stream else asyncio.subprocess.DEVNULL
+                proc = await asyncio.create_subprocess_exec(*command, stdin=stdin, stdout=asyncio.subprocess.PIPE,
+                                                            stderr=asyncio.subprocess.DEVNULL, limit=STREAM_LINE_LIMIT)
+                try:
+                    results = await asyncio.wait_for(self._communicate(proc, stream, binary), timeout)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+                    logger.error(f'Timeout for repeat ({timeout}s) expired')
+                    raise RuntimeError
+                except (BrokenPipeError, ConnectionResetError):
+                    proc.kill()
+                    await proc.wait()
+                    logger.error(f'Search stopped reading the edge graph, ec: {proc.returncode}')
+                    raise RuntimeError
+        if int(proc.returncode) != 0 or results is None:
             logger.error(f'Search failed for repeat, ec: {proc.returncode}')
             raise RuntimeError
-        return Results(str(proc.stdout))
+        return results
+
+    async def _communicate(self, proc: asyncio.subprocess.Process, stream: bool, binary: bool) -> Optional[Results]:
+        """
+        Write the edge graph to the search if it is streamed, while parsing its output line by line.
+        @return: The results, None if the output is incomplete
+        """
+        parser: Optional[ResultsParser] = ResultsParser(Results())
+
+        async def read():
+            nonlocal parser
+            # Keep reading after the results or an error, so the search does not block on a full pipe
+            async for line in proc.stdout:
+                if parser is not None and not parser.done:
+                    try:
+                        parser.feed(line.decode('utf-8'))
+                    except (ValueError, IndexError):
+                        parser = None
+
+        reader = asyncio.ensure_future(read())
+        try:
+            if stream:
+                for chunk in self._edge_graph_chunks(binary):
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+                proc.stdin.close()
+            await reader
+        finally:
+            reader.cancel()
+        await proc.wait()
+        try:
+            return parser.finish() if parser is not None else None
+        except ValueError:
+            # Incomplete output
+            return None
+
+    def _edge_graph_chunks(self, binary: bool) -> Iterator[bytes]:
+        """
+        @return: The edge graph in pieces of about STREAM_CHUNK_SIZE bytes, see write
+        """
+        if binary:
+            buffer = io.BytesIO()
+            self.binary_edge_graph().write(buffer)
+            data = buffer.getvalue()
+            for i in range(0, len(data), STREAM_CHUNK_SIZE):
+                yield data[i:i + STREAM_CHUNK_SIZE]
+            return
+        chunk: list[str] = []
+        size = 0
+        for line in self.lines():
+            chunk.append(line)
+            size += len(line)
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(chunk).encode('utf-8')
+                chunk, size = [], 0
+        yield "".join(chunk).encode('utf-8')
+
+
+async def run_searches(searches: Iterable[Tuple[FSIPP, Any, Any, float]], timeout,
+                       max_concurrent: Optional[int] = None, binary=False) -> list[Union[Results, BaseException]]:
+    """
+    Run many searches concurrently.
+    @param searches: Tuples of (flexSIPP, origin, destination, start_time)
+    @param timeout: Timeout in seconds of a single search
+    @param max_concurrent: Maximum number of searches running at the same time, defaults to the number of CPUs
+    @param binary: Give the edge graphs to the searches in the packed binary format
+    @return: Results per search, or the exception (RuntimeError) if that search failed
+    """
+    limit = asyncio.Semaphore(max_concurrent or os.cpu_count() or 1)
+    return await asyncio.gather(*[flexSIPP.run_search_async(timeout, origin, destination, start_time, limit, binary)
+                                  for flexSIPP, origin, destination, start_time in searches], return_exceptions=True)
@@ -1,24 +1,31 @@
 from __future__ import annotations
 
+import itertools
+import math
 import sys
-import queue as Q
 
+from collections import OrderedDict
 from logging import getLogger
-from typing import Generic, ClassVar, Tuple
+from typing import Generic, ClassVar, Tuple, Optional, Union, Type, Iterator
 
-from sortedcontainers import SortedKeyList
+import numpy as np
 
+from .dijkstra import dijkstra, multi_source_distances
+from .frozen_graph import FrozenGraph
+from .unsafe_intervals import SortedUnsafeIntervals, ArrayUnsafeIntervals
 from ..agent import Agent
 from ..util.intervals import UnsafeInterval, SafeInterval
 from ..util.types import EdgeType, NodeType
 
+UnsafeIntervals = Union[SortedUnsafeIntervals, ArrayUnsafeIntervals]
+
 logger = getLogger('__main__.' + __name__)
 
 
 class IntervalStore(object):
     def __init__(self):
         super().__init__()
-        self.unsafe_intervals: SortedKeyList[UnsafeInterval] = SortedKeyList(key=lambda x: x.start)
+        self.unsafe_intervals: UnsafeIntervals = SortedUnsafeIntervals()
         self.safe_intervals: list[SafeInterval] = []
         self.bt: dict[int, float] = {}
         self.crt: dict[int, float] = {}
@@ -27,22 +34,22 @@ class IntervalStore(object):
     def add_unsafe_interval(self, interval: UnsafeInterval):
         self.unsafe_intervals.add(interval)
 
+    def add_unsafe_intervals(self, intervals: list[UnsafeInterval]):
+        self.unsafe_intervals.update(intervals)
+
     def merge_unsafe_intervals(self):
         self.merged = True
-        if len(self.unsafe_intervals) == 0:
-            return
-        start = self.unsafe_intervals[0]
-        for next in self.unsafe_intervals[1:]:
-            # Check for overlap using intersection
-            if start & next:
-                start.merge(next)
-                self.unsafe_intervals.remove(next)
-            else:
-                start = next
+        self.unsafe_intervals.merge()
 
     def filter_out_agent(self, agent: Agent):
-        return [ui for ui in self.unsafe_intervals if ui.by_agent.id != agent.id]
+        return self.unsafe_intervals.filter_out_agent(agent)
 
+    def remove_agent(self, agent: Agent):
+        """
+        Remove the unsafe intervals and the flexibility of agent from this node/edge.
+        """
+        self.unsafe_intervals.remove_agent(agent)
+        self.remove_flexibility(agent)
 
     def add_flexibility(self, agent: Agent, bt: float, crt:float):
         """
@@ -60,6 +67,10 @@ class IntervalStore(object):
         else:
             self.crt[agent.id] = crt
 
+    def remove_flexibility(self, agent: Agent):
+        self.bt.pop(agent.id, None)
+        self.crt.pop(agent.id, None)
+
     def get_flexibility(self, agent: Agent) -> Tuple[float, float]:
         if isinstance(agent, int):
             return 0, 0
@@ -67,15 +78,27 @@ class IntervalStore(object):
         crt = self.crt[agent.id] if agent.id in self.crt else 0
         return bt, crt
 
-    def get_safe_intervals(self, global_end_time):
+    def get_safe_intervals(self, global_end_time, ids: Iterator[int]):
         assert self.merged
+        self.safe_intervals.extend(self.create_safe_intervals(self.unsafe_intervals, global_end_time, ids))
+
+    def create_safe_intervals(self, unsafe_intervals, global_end_time, ids: Iterator[int]) -> list[SafeInterval]:
+        """
+        Invert the given unsafe intervals of this node/edge, using the flexibility stored at this node/edge.
+        @param unsafe_intervals: Merged unsafe intervals, sorted on start time
+        @param global_end_time: End time of the last safe interval
+        @param ids: Allocator of the ids of the safe intervals, see Graph.interval_ids
+        @return: The safe intervals in between the unsafe intervals
+        """
+        safe_intervals: list[SafeInterval] = []
         current = 0
         agent_before = 0
         # Each tuple is (start, end, duration, train, recovery_time)
-        for start, end, dur, agent, recovery in self.unsafe_intervals:
+        for start, end, dur, agent, recovery in unsafe_intervals:
             if current > start:
                 bt_b, crt_b = self.get_flexibility(agent_before)
                 bt_a, crt_a = self.get_flexibility(agent)
+                # Not kept, so it does not get an id
                 interval = SafeInterval(current, start, agent_before, crt_b, agent, bt_a, crt_a)
                 agent_before = agent
                 logger.error(
@@ -88,15 +111,16 @@ class IntervalStore(object):
             else:
                 bt_b, crt_b = self.get_flexibility(agent_before)
                 bt_a, crt_a = self.get_flexibility(agent)
-                interval = SafeInterval(current, start, agent_before, crt_b, agent, bt_a, crt_a)
+                interval = SafeInterval(current, start, agent_before, crt_b, agent, bt_a, crt_a, next(ids))
                 agent_before = agent
                 current = end
                 # Dictionary with node keys, each entry has a dictionary with interval keys and then the index value
-                self.safe_intervals.append(interval)
+                safe_intervals.append(interval)
         if current < global_end_time:
             bt_b, crt_b = self.get_flexibility(agent_before)
-            last_interval = SafeInterval(current, global_end_time, agent_before, crt_b, 0, 0, 0)
-            self.safe_intervals.append(last_interval)
+            last_interval = SafeInterval(current, global_end_time, agent_before, crt_b, 0, 0, 0, next(ids))
+            safe_intervals.append(last_interval)
+        return safe_intervals
 
 
 class Node(IntervalStore, Generic[EdgeType, NodeType]):
@@ -105,6 +129,7 @@ class Node(IntervalStore, Generic[EdgeType, NodeType]):
         self.name = name
         self.outgoing:list[EdgeType] = []
         self.incoming:list[EdgeType] = []
+        self.graph: Optional[Graph] = None
 
     def get_identifier(self):
         return f"{self.name}"
@@ -130,54 +155,56 @@ class Node(IntervalStore, Generic[EdgeType, NodeType]):
         if isinstance(other, Node):
             return self.name < other.name
 
-    def calculate_path(self, to: NodeType):
-        distances = {self.name: 0.0}
-        previous: dict[str, NodeType] = {}
-
-        found = False
-        pq = Q.PriorityQueue()
-        pq.put((distances[self.name], self))
-        while not pq.empty() and not found:
-            u: NodeType = pq.get()[1]
-            for e in u.outgoing:
-                v = e.to_node
-                distance = distances[u.name] + e.length
-                if not v.name in distances or distance < distances[v.name]:
-                    distances[v.name] = distance
-                    previous[v.name] = u
-                    if v == to:
-                        found = True
-                        break
-                    pq.put((distances[v.name], v))
+    def calculate_path(self, to: NodeType) -> list[EdgeType]:
+        assert self.graph is not None, f"Node {self.name} is not part of a graph"
+        return self.graph.calculate_path(self, to)
 
-        path: list[EdgeType] = []
-        current = previous[to.name]
-        if found:
-            while current != self:
-                for x in current.incoming:
-                    if x.from_node == previous[current.name]:
-                        path.insert(0, x)
-                current = previous[current.name]
-        else:
-            logger.error(f"##### ERROR ### No path was found between {self.name} and {to.name}")
-        return path
-
-    def get_safe_connections(self) -> list[Tuple[SafeInterval, SafeInterval, SafeInterval, float]]:
+    def get_safe_connections(self, edges: Optional[list[EdgeType]] = None) \
+            -> list[Tuple[SafeInterval, SafeInterval, SafeInterval, float]]:
+        """
+        Find all combinations of a safe interval of this node, an outgoing edge and the to node that overlap.
+        Safe intervals of a node/edge are disjoint and sorted, so the overlapping intervals of each from/edge
+        interval are a consecutive range that is found with two pointers instead of testing every combination.
+        @param edges: Only use these outgoing edges, all outgoing edges if None
+        @return: (from interval, edge interval, to interval, edge length) in the order of
+        from interval, outgoing edge, edge interval and to interval
+        """
         assert len(self.safe_intervals) > 0
+        edge_ranges = []
+        for edge in self.outgoing if edges is None else edges:
+            edge_ranges.append((edge, _overlap_ranges(self.safe_intervals, edge.safe_intervals),
+                                _overlap_ranges(edge.safe_intervals, edge.to_node.safe_intervals)))
+
         safe_connections = []
-        for from_interval in self.safe_intervals:
-            for edge in self.outgoing:
-                for edge_interval in edge.safe_intervals:
-                    # Check for overlap with the from node and edge
-                    if from_interval & edge_interval:
-                        for to_interval in edge.to_node.safe_intervals:
-                            # Check for overlap with the edge en to node
-                            # TODO: figure out if overlap with from and to node is needed
-                            if edge_interval & to_interval:
-                                safe_connections.append((from_interval, edge_interval, to_interval, edge.length))
+        for i, from_interval in enumerate(self.safe_intervals):
+            for edge, from_edge, edge_to in edge_ranges:
+                to_intervals = edge.to_node.safe_intervals
+                for j in range(*from_edge[i]):
+                    edge_interval = edge.safe_intervals[j]
+                    # TODO: figure out if overlap with from and to node is needed
+                    for k in range(*edge_to[j]):
+                        safe_connections.append((from_interval, edge_interval, to_intervals[k], edge.length))
         return safe_connections
 
 
+def _overlap_ranges(a: list[SafeInterval], b: list[SafeInterval]) -> list[Tuple[int, int]]:
+    """
+    @param a: Disjoint intervals sorted on start time
+    @param b: Disjoint intervals sorted on start time
+    @return: Per interval of a, the range of indices of b that overlap with it (sharing an end point counts as overlap)
+    """
+    ranges = []
+    lo = hi = 0
+    for interval in a:
+        while lo < len(b) and b[lo].end < interval.start:
+            lo += 1
+        hi = max(hi, lo)
+        while hi < len(b) and b[hi].start <= interval.end:
+            hi += 1
+        ranges.append((lo, hi))
+    return ranges
+
+
 class Edge(IntervalStore, Generic[EdgeType, NodeType]):
     __last_id: ClassVar[int] = 1
 
@@ -209,15 +236,61 @@ class Edge(IntervalStore, Generic[EdgeType, NodeType]):
         return f"{self.from_node.name}--{self.to_node.name}"
 
 
+class ShortestPathTree(Generic[EdgeType, NodeType]):
+    """
+    Result of a single Dijkstra search from source: the distance to and the edge leading to every node,
+    indexed by the node ids of the frozen graph that was searched.
+    """
+    def __init__(self, fg: FrozenGraph[EdgeType, NodeType], source: NodeType, distances: list[float], previous_edge: list[int]):
+        self.fg = fg
+        self.source = source
+        self.distances = distances
+        self.previous_edge = previous_edge
+
+    def distance_to(self, node: NodeType) -> float:
+        d = self.distances[self.fg.index[node.name]]
+        return d if d < math.inf else sys.maxsize
+
+    def path_to(self, node: NodeType) -> list[EdgeType]:
+        """
+        @return: The edges from the source to node, or an empty list if node can not be reached
+        """
+        current = self.fg.index[node.name]
+        if self.distances[current] == math.inf:
+            logger.error(f"##### ERROR ### No path was found between {self.source.name} and {node.name}")
+            return []
+        path: list[EdgeType] = []
+        while self.previous_edge[current] != -1:
+            e = self.previous_edge[current]
+            path.append(self.fg.edges[e])
+            current = int(self.fg.edge_from[e])
+        path.reverse()
+        return path
+
+
 class Graph(Generic[EdgeType, NodeType]):
+    # Maximum number of shortest path trees that are kept in the cache
+    max_cached_trees: ClassVar[int] = 128
+
     def __init__(self):
         self.edges: list[EdgeType] = []
         self.nodes: dict[str, NodeType] = {}
         self.global_end_time = -1
+        # Ids of the safe intervals created in this graph, dense and starting at 0
+        self.interval_ids: Iterator[int] = itertools.count()
+        # Container used for the unsafe intervals of the nodes and edges in this graph
+        self.unsafe_interval_store: Type[UnsafeIntervals] = SortedUnsafeIntervals
+        self._shortest_path_trees: OrderedDict[Tuple[str, Optional[float]], ShortestPathTree[EdgeType, NodeType]] = OrderedDict()
+        self._frozen: Optional[FrozenGraph[EdgeType, NodeType]] = None
+        # velocity -> goal name -> time-distance to the goal per node index
+        self._heuristics: dict[Optional[float], dict[str, np.ndarray]] = {}
 
     def add_node(self, n: NodeType) -> NodeType:
         if isinstance(n, Node):
             self.nodes[n.name] = n
+            n.graph = self
+            self._use_unsafe_interval_store(n)
+            self.invalidate_shortest_paths()
         return n
 
     def add_edge(self, e: EdgeType) -> EdgeType:
@@ -225,8 +298,59 @@ class Graph(Generic[EdgeType, NodeType]):
             self.edges.append(e)
             e.to_node.incoming.append(e)
             e.from_node.outgoing.append(e)
+            self._use_unsafe_interval_store(e)
+            self.invalidate_shortest_paths()
         return e
 
+    def set_unsafe_interval_store(self, store: Type[UnsafeIntervals]):
+        """
+        Select the container for the unsafe intervals of all nodes and edges of this graph,
+        e.g. ArrayUnsafeIntervals to merge and filter the intervals with NumPy.
+        """
+        self.unsafe_interval_store = store
+        for ui in list(self.nodes.values()) + self.edges:
+            self._use_unsafe_interval_store(ui)
+
+    def _use_unsafe_interval_store(self, ui: IntervalStore):
+        if type(ui.unsafe_intervals) is not self.unsafe_interval_store:
+            ui.unsafe_intervals = self.unsafe_interval_store(ui.unsafe_intervals)
+
+    def invalidate_shortest_paths(self):
+        """
+        Drop all cached shortest path trees, needs to be called whenever edges are added or their length changes.
+        """
+        self._shortest_path_trees.clear()
+        self._frozen = None
+        self._heuristics.clear()
+
+    def freeze(self) -> FrozenGraph[EdgeType, NodeType]:
+        """
+        Get an immutable array-backed snapshot of the nodes and edges, which is reused until the graph changes.
+        """
+        if self._frozen is None:
+            self._frozen = FrozenGraph(self.nodes, self.edges)
+        return self._frozen
+
+    def shortest_path_tree(self, source: NodeType, agent_velocity: Optional[float] = None) -> ShortestPathTree[EdgeType, NodeType]:
+        """
+        Get the shortest path tree from source, either from the cache or by running Dijkstra.
+        @param source: Node to start the search from
+        @param agent_velocity: Maximum velocity of the agent to calculate time-distances,
+        or None to use the edge lengths as weights
+        """
+        key = (source.name, agent_velocity)
+        if key in self._shortest_path_trees:
+            self._shortest_path_trees.move_to_end(key)
+            return self._shortest_path_trees[key]
+
+        fg = self.freeze()
+        distances, previous_edge = dijkstra(fg, fg.index[source.name], agent_velocity, predecessors=True)
+        tree = ShortestPathTree(fg, source, distances, previous_edge)
+        self._shortest_path_trees[key] = tree
+        if len(self._shortest_path_trees) > self.max_cached_trees:
+            self._shortest_path_trees.popitem(last=False)
+        return tree
+
     def __repr__(self) -> str:
         return f"Graph with {len(self.edges)} edges and {len(self.nodes)} nodes:\n{self.nodes.values()}"
 
@@ -237,90 +361,63 @@ class Graph(Generic[EdgeType, NodeType]):
                     self.global_end_time == other.global_end_time)
         return NotImplemented
 
-    def invert_unsafe_intervals(self):
+    def invert_unsafe_intervals(self, uis: Optional[list[IntervalStore]] = None):
         """
             Creates safe intervals by inverting the unsafe intervals of all the nodes and edges in the graph.
+            @param uis: Only invert the unsafe intervals of these nodes and edges
         """
-        uis: list[IntervalStore] = list(self.nodes.values()) + self.edges
+        if uis is None:
+            uis = list(self.nodes.values()) + self.edges
         for ui in uis:
-            ui.get_safe_intervals(self.global_end_time)
+            ui.get_safe_intervals(self.global_end_time, self.interval_ids)
 
     def calculate_heuristic(self, start: NodeType, agent_velocity) -> dict[str, float]:
-        time_distances = {n: float("inf") for n in self.nodes}
-        pq = Q.PriorityQueue()
-        time_distances[start.name] = 0.0
-        pq_counter = 0
-        # Use a counter so it doesn't have to compare nodes
-        pq.put((time_distances[start.name], pq_counter, start))
-        pq_counter += 1
         # This does not include the other node intervals: this will have to be updated with propagating SIPP searches
-        while not pq.empty():
-            v: NodeType = pq.get()[2]
-            for e in v.incoming:
-                velocity = min(e.max_speed, agent_velocity)
-                tmp = time_distances[v.name] + (e.length / velocity)
-                if tmp < time_distances[e.from_node.name]:
-                    time_distances[e.from_node.name] = tmp
-                    pq.put((time_distances[e.from_node.name], pq_counter, e.from_node))
-                    pq_counter += 1
-                    logger.debug(f"time-distance to {e.from_node.name}: {tmp}")
-        return time_distances
+        time_distances = self.calculate_heuristics([start], agent_velocity)[0]
+        return dict(zip(self.freeze().names(), time_distances.tolist()))
+
+    def calculate_heuristics(self, goals: list[NodeType], agent_velocity) -> np.ndarray:
+        """
+        Calculate the time-distance from every node to each of the goals.
+        Goals that are not cached yet for this velocity are calculated together in a single batch.
+        @param goals: Nodes to calculate the time-distances to
+        @param agent_velocity: Maximum velocity of the agent, edges with a lower max_speed are traversed slower
+        @return: goals x nodes matrix, the columns are in the order of the node indices of freeze()
+        """
+        fg = self.freeze()
+        cache = self._heuristics.setdefault(agent_velocity, {})
+        missing = list(dict.fromkeys(goal.name for goal in goals if goal.name not in cache))
+        if missing:
+            time_distances = multi_source_distances(fg, [fg.index[name] for name in missing], agent_velocity, reverse=True)
+            time_distances.flags.writeable = False
+            for name, row in zip(missing, time_distances):
+                cache[name] = row
+        if len(goals) == 0:
+            return np.empty((0, fg.n_nodes))
+        return np.stack([cache[goal.name] for goal in goals])
+
+    def calculate_distances(self, start: NodeType, agent_velocity) -> dict[str, float]:
+        """
+        Calculate the shortest time-distance from start to every node in the graph.
+        @param start: Node to calculate the distances from
+        @param agent_velocity: Maximum velocity of the agent, edges with a lower max_speed are traversed slower
+        @return: Dictionary with the time-distance per node name, sys.maxsize if a node can not be reached
+        """
+        fg = self.freeze()
+        time_distances, _ = dijkstra(fg, fg.index[start.name], agent_velocity)
+        return {n: d if d < math.inf else sys.maxsize for n, d in zip(fg.names(), time_distances)}
 
     def distance_between_nodes(self, start: NodeType, end: NodeType, agent_velocity):
-        time_distances = {n: sys.maxsize for n in self.nodes}
-        pq = Q.PriorityQueue()
-        time_distances[start.name] = 0
-        pq_counter = 0
-        # Use a counter so it doesn't have to compare nodes
-        pq.put((time_distances[start.name], pq_counter, start))
-        pq_counter += 1
-        # This does not include the other node intervals: this will have to be updated with propagating SIPP searches
-        while not pq.empty():
-            u = pq.get()[2]
-            for e in u.outgoing:
-                velocity = min(e.max_speed, agent_velocity)
-                tmp = time_distances[u.name] + (e.length / velocity)
-                v = e.to_node
-                if tmp < time_distances[v.name]:
-                    time_distances[v.name] = tmp
-                    if end is not None and v.name == end.name:
-                        return tmp
-                    pq.put((time_distances[v.name], pq_counter, v))
-                    pq_counter += 1
-        return sys.maxsize
+        key = (start.name, agent_velocity)
+        if key in self._shortest_path_trees:
+            return self._shortest_path_trees[key].distance_to(end)
+        fg = self.freeze()
+        target = fg.index[end.name]
+        time_distances, _ = dijkstra(fg, fg.index[start.name], agent_velocity, target=target)
+        return time_distances[target] if time_distances[target] < math.inf else sys.maxsize
 
     def calculate_path(self, start: NodeType, end: NodeType) -> list[EdgeType]:
-        distances = {n: sys.maxsize for n in self.nodes}
-        previous = {n: None for n in self.nodes}
-        previous_edge = {n: None for n in self.nodes}
-        pq = Q.PriorityQueue()
-        distances[start.name] = 0
-        pq_counter = 0
-        # Use a counter so it doesn't have to compare nodes
-        pq.put((distances[start.name], pq_counter, start))
-        pq_counter += 1
-        # This does not include the other node intervals: this will have to be updated with propagating SIPP searches
-        while not pq.empty():
-            u = pq.get()[2]
-            for v in u.outgoing:
-                tmp = distances[u.name] + v.length
-                if tmp < distances[v.to_node.name]:
-                    distances[v.to_node.name] = tmp
-                    previous[v.to_node.name] = u
-                    previous_edge[v.to_node.name] = v
-                    pq.put((distances[v.to_node.name], pq_counter, v.to_node))
-                    pq_counter += 1
-        path = []
-        current = end
-        try:
-            while current != start:
-                for x in current.incoming:
-                    if x.from_node == previous[current.name]:
-                        path.insert(0, x)
-                current = previous[current.name]
-        except Exception as e:
-            logger.error(f"##### ERROR ### {e} No path was found between {start.name} and {end.name}")
-        return path
+        return self.shortest_path_tree(start).path_to(end)
 
     def get_initial_direction(self, start, end, agent_velocity):
         start_a, start_b = start
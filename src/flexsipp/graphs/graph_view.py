@@ -0,0 +1,141 @@
+import itertools
+from typing import Generic, Optional, Tuple, Iterable, Union, Iterator
+
+from .graph import Graph, Node, Edge, IntervalStore
+from ..agent import Agent
+from ..util.intervals import SafeInterval, UnsafeInterval
+from ..util.types import EdgeType, NodeType
+
+
+class IntervalStoreView(object):
+    """
+    Read-only overlay of an IntervalStore without the unsafe intervals of one agent.
+    The filtered unsafe intervals and the resulting safe intervals are calculated on first access and stored in the
+    view, the underlying node/edge is never modified.
+    """
+    def __init__(self, base: IntervalStore, graph: "GraphView"):
+        self.base = base
+        self.graph = graph
+        self._unsafe_intervals: Optional[list[UnsafeInterval]] = None
+        self._safe_intervals: Optional[list[SafeInterval]] = None
+
+    @property
+    def unsafe_intervals(self):
+        if self._unsafe_intervals is None:
+            self._unsafe_intervals = self.base.filter_out_agent(self.graph.agent)
+        return self._unsafe_intervals
+
+    @property
+    def safe_intervals(self) -> list[SafeInterval]:
+        if self._safe_intervals is None:
+            assert self.base.merged
+            self._safe_intervals = self.base.create_safe_intervals(self.unsafe_intervals, self.graph.global_end_time,
+                                                                   self.graph.interval_ids)
+        return self._safe_intervals
+
+    def get_flexibility(self, agent: Agent) -> Tuple[float, float]:
+        return self.base.get_flexibility(agent)
+
+    def invalidate(self):
+        """
+        Forget the calculated intervals, so they are calculated again from the (changed) base on next access.
+        """
+        self._unsafe_intervals = None
+        self._safe_intervals = None
+
+
+class NodeView(IntervalStoreView, Generic[EdgeType, NodeType]):
+    def __init__(self, base: Node, graph: "GraphView"):
+        super().__init__(base, graph)
+        self.name = base.name
+        self.outgoing: list[EdgeView] = []
+        self.incoming: list[EdgeView] = []
+
+    def get_identifier(self):
+        return self.base.get_identifier()
+
+    def get_safe_connections(self, edges: Optional[list["EdgeView"]] = None) \
+            -> list[Tuple[SafeInterval, SafeInterval, SafeInterval, float]]:
+        # The view has the same attributes that Node.get_safe_connections uses
+        return Node.get_safe_connections(self, edges)
+
+    def __repr__(self) -> str:
+        return f"NodeView {self.name}"
+
+    def __str__(self) -> str:
+        return f"{self.name}"
+
+
+class EdgeView(IntervalStoreView, Generic[EdgeType, NodeType]):
+    def __init__(self, base: Edge, graph: "GraphView", from_node: NodeView, to_node: NodeView):
+        super().__init__(base, graph)
+        self.from_node = from_node
+        self.to_node = to_node
+        self.max_speed = base.max_speed
+        # Length in time instead of distance
+        self.length = base.length / graph.agent_velocity
+
+    @property
+    def id(self):
+        return self.base.id
+
+    def get_identifier(self):
+        return self.base.get_identifier()
+
+    def __repr__(self) -> str:
+        return f"EdgeView from {self.from_node.name} to {self.to_node.name} with length {self.length}"
+
+    def __str__(self):
+        return f"{self.from_node.name}--{self.to_node.name}"
+
+
+class GraphView(Generic[EdgeType, NodeType]):
+    """
+    Overlay of a Graph as seen by a single replanning agent: the unsafe intervals of the agent are filtered out and
+    the edge lengths are converted to time using the velocity of the agent. Can be used instead of the graph in FSIPP,
+    multiple views of the same graph can exist next to each other.
+    """
+    def __init__(self, g: Graph[EdgeType, NodeType], agent: Agent, agent_velocity: float):
+        self.base = g
+        self.agent = agent
+        self.agent_velocity = agent_velocity
+        self.global_end_time = g.global_end_time
+        # The safe intervals of a view have their own ids, see Graph.interval_ids
+        self.interval_ids: Iterator[int] = itertools.count()
+
+        self.nodes: dict[str, NodeView[EdgeType, NodeType]] = {name: NodeView(n, self) for name, n in g.nodes.items()}
+        self.edges: list[EdgeView[EdgeType, NodeType]] = []
+        self._edges_by_id: dict[int, EdgeView[EdgeType, NodeType]] = {}
+        for e in g.edges:
+            from_node, to_node = self.nodes[e.from_node.name], self.nodes[e.to_node.name]
+            edge = EdgeView(e, self, from_node, to_node)
+            self.edges.append(edge)
+            self._edges_by_id[e.id] = edge
+            from_node.outgoing.append(edge)
+            to_node.incoming.append(edge)
+
+    def invert_unsafe_intervals(self, uis: Optional[list[IntervalStoreView]] = None):
+        """
+            Creates safe intervals of all the nodes and edges in the view.
+            @param uis: Only create the safe intervals of these nodes and edges
+        """
+        if uis is None:
+            uis = list(self.nodes.values()) + self.edges
+        for ui in uis:
+            _ = ui.safe_intervals
+
+    def update(self, changed: Iterable[Union[Node, Edge]]) -> list[Union[NodeView, EdgeView]]:
+        """
+        Invalidate the views of nodes/edges of which the unsafe intervals or flexibility changed.
+        @param changed: Changed nodes/edges of the base graph
+        @return: The invalidated views
+        """
+        views: list[Union[NodeView, EdgeView]] = []
+        for ui in changed:
+            view = self.nodes[ui.name] if isinstance(ui, Node) else self._edges_by_id[ui.id]
+            view.invalidate()
+            views.append(view)
+        return views
+
+    def __repr__(self) -> str:
+        return f"GraphView for agent {self.agent} with {len(self.edges)} edges and {len(self.nodes)} nodes"
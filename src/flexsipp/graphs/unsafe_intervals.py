@@ -0,0 +1,164 @@
+from copy import copy
+from operator import attrgetter
+from typing import Iterable, Optional, Union
+
+import numpy as np
+from sortedcontainers import SortedKeyList
+
+from ..agent import Agent
+from ..util.intervals import UnsafeInterval
+
+
+class SortedUnsafeIntervals(SortedKeyList):
+    """
+    Unsafe intervals of a node/edge as UnsafeInterval objects in a list sorted on start time.
+    The interval objects are shared with the other nodes/edges they were added to, merging replaces them by a copy
+    so it does not affect the other nodes/edges.
+    """
+    def __init__(self, iterable: Optional[Iterable[UnsafeInterval]] = None, key=attrgetter("start")):
+        super().__init__(iterable, key=key)
+
+    def merge(self):
+        """
+        Merge all overlapping intervals (which should be caused by the same agent) into a single interval.
+        """
+        merged: list[UnsafeInterval] = []
+        copied = False
+        for next in self:
+            # Check for overlap using intersection
+            if merged and merged[-1].overlaps(next):
+                if not copied:
+                    merged[-1] = copy(merged[-1])
+                    copied = True
+                merged[-1].merge(next)
+            else:
+                merged.append(next)
+                copied = False
+        if len(merged) != len(self):
+            self.clear()
+            self.update(merged)
+
+    def filter_out_agent(self, agent: Agent) -> list[UnsafeInterval]:
+        return [ui for ui in self if ui.by_agent.id != agent.id]
+
+    def remove_agent(self, agent: Agent):
+        """
+        Remove all intervals of agent from the list.
+        """
+        remaining = self.filter_out_agent(agent)
+        if len(remaining) != len(self):
+            self.clear()
+            self.update(remaining)
+
+
+def _agent_id(agent: Union[Agent, int]) -> int:
+    return agent.id if isinstance(agent, Agent) else agent
+
+
+class ArrayUnsafeIntervals(object):
+    """
+    Unsafe intervals of a node/edge as parallel NumPy arrays (start, end, duration, agent id, recovery time)
+    sorted on start time. Merging and filtering are done on the arrays at once, UnsafeInterval objects are only
+    created when the intervals are accessed one by one.
+    The values are copied on add, so like SortedUnsafeIntervals merging does not affect other nodes/edges.
+    """
+    def __init__(self, iterable: Optional[Iterable[UnsafeInterval]] = None):
+        self.start = np.empty(0, dtype=np.float64)
+        self.end = np.empty(0, dtype=np.float64)
+        self.duration = np.empty(0, dtype=np.float64)
+        self.agent_id = np.empty(0, dtype=np.int64)
+        self.recovery = np.empty(0, dtype=np.float64)
+        self.agents: dict[int, Union[Agent, int]] = {}
+        # Added intervals that are not yet in the arrays
+        self._pending: list[tuple[float, float, float, int, float]] = []
+        self._intervals: Optional[list[UnsafeInterval]] = None
+        if iterable is not None:
+            for interval in iterable:
+                self.add(interval)
+
+    @classmethod
+    def _from_arrays(cls, start, end, duration, agent_id, recovery, agents) -> "ArrayUnsafeIntervals":
+        store = cls()
+        store.start, store.end, store.duration, store.agent_id, store.recovery = start, end, duration, agent_id, recovery
+        store.agents = agents
+        return store
+
+    def add(self, interval: UnsafeInterval):
+        agent_id = _agent_id(interval.by_agent)
+        self.agents.setdefault(agent_id, interval.by_agent)
+        self._pending.append((interval.start, interval.end, interval.duration, agent_id, interval.local_recovery_time))
+        self._intervals = None
+
+    def update(self, intervals: Iterable[UnsafeInterval]):
+        for interval in intervals:
+            self.add(interval)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        start, end, duration, agent_id, recovery = (np.array(column) for column in zip(*self._pending))
+        self._pending = []
+        start = np.concatenate((self.start, start))
+        # A stable sort keeps intervals with the same start in the order they were added, like SortedKeyList
+        order = np.argsort(start, kind="stable")
+        self.start = start[order]
+        self.end = np.concatenate((self.end, end))[order]
+        self.duration = np.concatenate((self.duration, duration))[order]
+        self.agent_id = np.concatenate((self.agent_id, agent_id.astype(np.int64)))[order]
+        self.recovery = np.concatenate((self.recovery, recovery))[order]
+
+    def merge(self):
+        """
+        Merge all overlapping intervals (which should be caused by the same agent) into a single interval.
+        """
+        self._flush()
+        if len(self.start) == 0:
+            return
+        # An interval starts a new group if it starts after all previous intervals have ended
+        first = np.ones(len(self.start), dtype=bool)
+        first[1:] = self.start[1:] > np.maximum.accumulate(self.end)[:-1]
+        idx = np.flatnonzero(first)
+        group = np.cumsum(first) - 1
+        assert np.all(self.agent_id == self.agent_id[idx][group]), "Overlapping unsafe intervals of different agents"
+
+        self.end = np.maximum.reduceat(self.end, idx)
+        self.duration = np.add.reduceat(self.duration, idx)
+        self.recovery = np.add.reduceat(self.recovery, idx)
+        self.start = self.start[idx]
+        self.agent_id = self.agent_id[idx]
+        self._intervals = None
+
+    def filter_out_agent(self, agent: Agent) -> "ArrayUnsafeIntervals":
+        self._flush()
+        mask = self.agent_id != agent.id
+        return self._from_arrays(self.start[mask], self.end[mask], self.duration[mask], self.agent_id[mask],
+                                 self.recovery[mask], self.agents)
+
+    def remove_agent(self, agent: Agent):
+        """
+        Remove all intervals of agent from the arrays.
+        """
+        remaining = self.filter_out_agent(agent)
+        self.start, self.end, self.duration, self.agent_id, self.recovery = \
+            remaining.start, remaining.end, remaining.duration, remaining.agent_id, remaining.recovery
+        self._intervals = None
+
+    def _materialize(self) -> list[UnsafeInterval]:
+        self._flush()
+        if self._intervals is None:
+            self._intervals = [UnsafeInterval(s, e, d, self.agents[a], r) for s, e, d, a, r in
+                               zip(self.start.tolist(), self.end.tolist(), self.duration.tolist(),
+                                   self.agent_id.tolist(), self.recovery.tolist())]
+        return self._intervals
+
+    def __len__(self):
+        return len(self.start) + len(self._pending)
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __getitem__(self, item):
+        return self._materialize()[item]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._materialize()})"
@@ -1,13 +1,18 @@
-import queue as Q
+import math
+import os
 import sys
-from typing import Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+from multiprocessing.context import BaseContext
+from typing import Any, Iterator, Mapping, NamedTuple, Optional, Tuple
 from logging import getLogger, Logger
-from copy import copy
 
 from tqdm import tqdm
 
 from ..agent import Agent
-from ..graphs.graph import Graph, Node, Edge
+from ..graphs.distance_oracle import DistanceOracle
+from ..graphs.graph import Graph, Node, Edge, IntervalStore
 from ..railways.track_graph import TrackEdge, TrackNode, TrackGraph, Signal
 from ..util.plotting_info import PlottingStore
 
@@ -36,12 +41,20 @@ class BlockEdge(Edge["BlockEdge", "BlockNode"], PlottingStore):
 
     def add_flexibility(self, agent: Agent, bt: float, crt:float):
         # Store the buffer and crt
+        conflict_index = self.from_node.graph.conflict_index
         for tr in self.track_route:
-            blocks = tr.blocks.union(tr.from_node.blocks)
-            for block in blocks:
+            for block in conflict_index[tr].interval_stores:
                 super(type(block), block).add_flexibility(agent, bt, crt)
 
 
+class TrackConflicts(NamedTuple):
+    # Nodes/edges of the block graph that a train on the track edge adds its unsafe intervals and flexibility to
+    interval_stores: Tuple[IntervalStore, ...]
+    # Track edges that a train on the track edge adds its plotting times to: the opposite and associated edges and
+    # the edge itself
+    plotting_edges: Tuple[TrackEdge, ...]
+
+
 class TqdmLogger:
     """File-like class redirecting tqdm progress bar to given logging logger."""
     def __init__(self, l: Logger):
@@ -57,19 +70,29 @@ class BlockGraph(Graph[BlockEdge, BlockNode]):
     def __init__(self, g: TrackGraph):
         super().__init__()
         self.tg = g
+        self._distance_oracle: DistanceOracle[BlockEdge, BlockNode] | None = None
+        self._conflict_index: Optional[Mapping[TrackEdge, TrackConflicts]] = None
 
     @classmethod
-    def from_track_graph(cls, g: TrackGraph):
+    def from_track_graph(cls, g: TrackGraph, workers: Optional[int] = 1,
+                         mp_context: Optional[BaseContext] = None):
+        """
+        @param workers: Number of worker processes that enumerate the blocks of the signals, None for the number of
+        CPUs. The default 1 runs in the current process. The block edges are added in the same order for any number of
+        workers.
+        @param mp_context: Multiprocessing context of the workers, see graph_cache.worker_context
+        """
         g_block = cls(g)
+        g_block.add_signal_nodes()
         track_to_signal = {signal.track: signal for signal in g.signals}
-        for signal in g.signals:
-            block = g_block.add_node(BlockNode(f"{signal.id}"))
-            signal.track.blocks.add(block)
-            for out_e in signal.track.outgoing:
-                for opp in out_e.to_node.opposites:
-                    opp.blocks.add(block)
-        for signal in tqdm(g.signals, file=TqdmLogger(logger), mininterval=1, ascii=False):
-            blocks = g_block.generate_signal_blocks(signal, g.signals)
+        enumerator = BlockEnumerator(g, g.signals)
+        if workers == 1:
+            signal_routes = map(enumerator.signal_routes, g.signals)
+        else:
+            signal_routes = _parallel_signal_routes(g, workers, mp_context)
+        for signal, routes in tqdm(zip(g.signals, signal_routes), total=len(g.signals), file=TqdmLogger(logger),
+                                   mininterval=1, ascii=False):
+            blocks = enumerator.to_blocks(routes)
             for idx, (block, route, length, max_velocity) in enumerate(blocks):
 
                 # Create edges in g_block
@@ -81,57 +104,216 @@ class BlockGraph(Graph[BlockEdge, BlockNode]):
                 direction = "".join(set(signal.direction + to_signal.direction))
                 e = g_block.add_edge(BlockEdge(from_signal_node, to_signal_node, length, route, direction, max_velocity))
                 logger.debug(f"Found block {e} with length {length} and max velocity {max_velocity}")
+        g_block._conflict_index = g_block.build_conflict_index()
         return g_block
 
+    def add_signal_nodes(self):
+        """
+        Add a block node for every signal of the track graph, and register it at the tracks that it covers.
+        """
+        for signal in self.tg.signals:
+            block = self.add_node(BlockNode(f"{signal.id}"))
+            signal.track.blocks.add(block)
+            for out_e in signal.track.outgoing:
+                for opp in out_e.to_node.opposites:
+                    opp.blocks.add(block)
+
     def __eq__(self, other):
         return super().__eq__(other)
 
+    def invalidate_shortest_paths(self):
+        super().invalidate_shortest_paths()
+        self._distance_oracle = None
+        # Adding block nodes/edges changes the blocks of the tracks
+        self._conflict_index = None
+
+    def build_conflict_index(self) -> Mapping[TrackEdge, TrackConflicts]:
+        """
+        @return: Read-only mapping from every track edge to the blocks and track edges that a train on it affects
+        """
+        return MappingProxyType({e: TrackConflicts(tuple(e.blocks.union(e.from_node.blocks)),
+                                                   tuple(e.opposites + e.associated + [e]))
+                                 for e in self.tg.edges})
+
+    @property
+    def conflict_index(self) -> Mapping[TrackEdge, TrackConflicts]:
+        """
+        Conflict index of the track edges, built by from_track_graph or on first use.
+        """
+        if self._conflict_index is None:
+            self._conflict_index = self.build_conflict_index()
+        return self._conflict_index
+
+    @property
+    def distance_oracle(self) -> DistanceOracle[BlockEdge, BlockNode]:
+        """
+        Distance oracle between the blocks of all stations in the location, created on first use. Stations without
+        a block in both directions are left out, distances to them are calculated without the oracle.
+        """
+        if self._distance_oracle is None:
+            terminals = []
+            for station in self.tg.stations:
+                try:
+                    terminals.extend(self.get_block_from_station(station))
+                except StopIteration:
+                    logger.warning(f"Station {station} has no A and B block, it is not in the distance oracle")
+            self._distance_oracle = DistanceOracle(self, terminals)
+        return self._distance_oracle
+
+    def distance_between_nodes(self, start: BlockNode, end: BlockNode, agent_velocity):
+        oracle = self.distance_oracle
+        if start in oracle and end in oracle:
+            return oracle.distance(start, end, agent_velocity)
+        return super().distance_between_nodes(start, end, agent_velocity)
+
     def get_block_from_station(self, station: str) -> Tuple[BlockNode, BlockNode]:
         track_a, track_b = self.tg.stations[station]
         block_a = next(iter([block for block in track_a.blocks if block.name[-1] == "A"]))
         block_b = next(iter([block for block in track_b.blocks if block.name[-1] == "B"]))
         return block_a, block_b
 
-    def generate_signal_blocks(self, from_signal: Signal, signals: list[Signal]) \
+    def generate_signal_blocks(self, from_signal: Signal, signals: list[Signal],
+                               enumerator: Optional["BlockEnumerator"] = None) \
             -> list[Tuple[list[TrackNode], list[TrackEdge], float, float]]:
+        """
+        @param enumerator: Enumerator to reuse for all signals, created for signals if not given
+        @return: (tracks, track edges, length, max velocity) of every block starting at the signal
+        """
+        if enumerator is None:
+            enumerator = BlockEnumerator(self.tg, signals)
+        return enumerator.to_blocks(enumerator.signal_routes(from_signal))
+
+
+# Index-based route: (track ids, track edge ids, length, max velocity), ids of the FrozenGraph of the track graph
+Route = Tuple[tuple[int, ...], tuple[int, ...], float, float]
+
+# Enumerator used by the block worker processes, set by _init_block_worker
+_block_enumerator: Optional["BlockEnumerator"] = None
+
+
+def _init_block_worker(tg: Optional[TrackGraph], data: Optional[dict[str, Any]] = None):
+    """
+    @param tg: Track graph, if it is shared by forking
+    @param data: Otherwise the snapshot_track_graph of the track graph, see graph_cache
+    """
+    global _block_enumerator
+    if tg is None:
+        from .graph_cache import restore_track_graph
+        tg = restore_track_graph(data)
+    _block_enumerator = BlockEnumerator(tg, tg.signals)
+
+
+def _signal_routes(signals: range) -> list[list[Route]]:
+    return [_block_enumerator.signal_routes(_block_enumerator.signals[i]) for i in signals]
+
+
+def _parallel_signal_routes(tg: TrackGraph, workers: Optional[int],
+                            mp_context: Optional[BaseContext] = None) -> Iterator[list[Route]]:
+    """
+    Enumerate the routes of all signals on a process pool, workers that are not forked get a snapshot_track_graph.
+    @return: The routes per signal, in the order of tg.signals
+    """
+    from .graph_cache import snapshot_track_graph, worker_context
+    workers = workers or os.cpu_count() or 1
+    # A few chunks per worker, to balance the load without sending every signal separately
+    chunk_size = max(1, math.ceil(len(tg.signals) / (4 * workers)))
+    chunks = [range(i, min(i + chunk_size, len(tg.signals))) for i in range(0, len(tg.signals), chunk_size)]
+    mp_context = worker_context(mp_context)
+    initargs = (tg,) if mp_context.get_start_method() == "fork" else (None, snapshot_track_graph(tg))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                             initializer=_init_block_worker, initargs=initargs) as pool:
+        for routes in pool.map(_signal_routes, chunks):
+            yield from routes
+
+
+class BlockEnumerator(object):
+    """
+    Breadth-first enumeration of the routes from a start track to the next signal, on the FrozenGraph of the track
+    graph. A route is a chain of parent pointers, so routes share their prefix instead of copying it, and the routes
+    from a start track are memoised because they do not depend on the signal.
+    """
+    def __init__(self, tg: TrackGraph, signals: list[Signal]):
+        self.fg = tg.freeze()
+        self.offsets, self.neighbours, self.edge_ids = self.fg.adjacency_lists()
+        self.length = self.fg.length.tolist()
+        self.max_speed = self.fg.max_speed.tolist()
         end_tracks = {s.track.get_identifier() for s in signals}
-        start_tracks = [track.to_node for track in from_signal.track.outgoing]
+        self.is_end_track = [n.get_identifier() in end_tracks for n in self.fg.nodes]
+        self.signals = signals
+        self._routes: dict[int, list[Route]] = {}
 
+    def signal_routes(self, from_signal: Signal) -> list[Route]:
+        """
+        @return: The routes from the tracks after the signal to the next signals
+        """
         result = []
+        for track in from_signal.track.outgoing:
+            result.extend(self.routes(track.to_node))
+        # The routes of all start tracks are found in one breadth-first search, shorter routes come first
+        result.sort(key=lambda route: len(route[0]))
+        return result
 
-        queue = Q.Queue()
-        for start_track in start_tracks:
-            queue.put(([start_track], [], set(), 0.0, sys.maxsize))
+    def routes(self, start_track: TrackNode) -> list[Route]:
+        start = self.fg.index[start_track.name]
+        if start not in self._routes:
+            self._routes[start] = self._enumerate(start)
+        return self._routes[start]
 
-        while not queue.empty():
-            route, edge_route, visited, length, max_velocity = queue.get()
+    def to_blocks(self, routes: list[Route]) -> list[Tuple[list[TrackNode], list[TrackEdge], float, float]]:
+        """
+        @return: The routes with the tracks and track edges instead of their ids
+        """
+        return [([self.fg.nodes[n] for n in nodes], [self.fg.edges[e] for e in edges], length, max_velocity)
+                for nodes, edges, length, max_velocity in routes]
 
-            if len(route[-1].outgoing) == 0:
+    def _enumerate(self, start: int) -> list[Route]:
+        # Route entries: (track, parent entry, edge from the parent track, length, max velocity)
+        result = []
+        queue = deque([(start, None, -1, 0.0, sys.maxsize)])
+        while queue:
+            entry = queue.popleft()
+            track, _, _, length, max_velocity = entry
+
+            if self.offsets[track] == self.offsets[track + 1]:
                 #No outgoing edges, what to do?
                 # Should only happen when at the end of a track, and it's not allowed to turn around
-                logger.debug(f"No outgoing edges at {route[-1]}")
+                logger.debug(f"No outgoing edges at {self.fg.nodes[track]}")
                 continue
 
-            for e in route[-1].outgoing:
-                next_track = e.to_node
-
-                if route[-1].get_identifier() in end_tracks:
-                    croute = copy(route)
-                    # route.append(next_track)
-                    cedge_route = copy(edge_route)
-                    cedge_route.append(e)
-                    result.append((croute, cedge_route, length + e.length, min(max_velocity, e.max_speed)))
-
-                elif route[-1] not in visited:
-                    croute = copy(route)
-                    croute.append(next_track)
+            for i in range(self.offsets[track], self.offsets[track + 1]):
+                e = self.edge_ids[i]
+                if self.is_end_track[track]:
+                    result.append((entry, e, length + self.length[e], min(max_velocity, self.max_speed[e])))
+                elif not self._visited(entry, track):
+                    queue.append((self.neighbours[i], entry, e, length + self.length[e],
+                                  min(max_velocity, self.max_speed[e])))
 
-                    cvisited = copy(visited)
-                    cvisited.add(next_track)
+        return [(self._tracks(entry), self._edges(entry) + (e,), length, max_velocity)
+                for entry, e, length, max_velocity in result]
 
-                    cedge_route = copy(edge_route)
-                    cedge_route.append(e)
+    @staticmethod
+    def _visited(entry, track: int) -> bool:
+        """
+        Whether the track was added to the route after the start track.
+        """
+        while entry[1] is not None:
+            if entry[0] == track:
+                return True
+            entry = entry[1]
+        return False
 
-                    queue.put((croute, cedge_route, cvisited, length + e.length, min(max_velocity, e.max_speed)))
+    @staticmethod
+    def _tracks(entry) -> tuple[int, ...]:
+        tracks = []
+        while entry is not None:
+            tracks.append(entry[0])
+            entry = entry[1]
+        return tuple(reversed(tracks))
 
-        return result
\ No newline at end of file
+    @staticmethod
+    def _edges(entry) -> tuple[int, ...]:
+        edges = []
+        while entry[1] is not None:
+            edges.append(entry[2])
+            entry = entry[1]
+        return tuple(reversed(edges))
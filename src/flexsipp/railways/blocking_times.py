@@ -0,0 +1,134 @@
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Tuple
+
+import numpy as np
+
+from ..railways.track_graph import TrackEdge
+
+if TYPE_CHECKING:
+    from ..railways.train_agent import TrainItem
+
+
+@dataclass
+class BlockingTimes:
+    """
+    Blocking times of the track edges of a route, one element per track edge. TrainAgent.calculate_blocking_times
+    creates the occupation and approach intervals from these.
+    """
+    # Time the train reaches the edge
+    start: np.ndarray
+    # End of the occupation, including the clearing, station and release time
+    end: np.ndarray
+    # Running and station time
+    duration: np.ndarray
+    # Local recovery time
+    recovery: np.ndarray
+    approach_start: np.ndarray
+    # Time the train leaves the edge, the start of the next edge
+    approach_end: np.ndarray
+    # Average velocity on the edge and velocity at the end of the edge
+    velocity: np.ndarray
+    end_velocity: np.ndarray
+
+
+def route_arrays(track_edges: list[TrackEdge], agent_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    @return: Length, max speed and departure time of the stop of the agent (nan if it does not stop) per edge
+    """
+    length = np.fromiter((e.length for e in track_edges), dtype=np.float64, count=len(track_edges))
+    max_speed = np.fromiter((e.max_speed for e in track_edges), dtype=np.float64, count=len(track_edges))
+    departure = np.fromiter((e.stops_at_station.get(agent_id, math.nan) for e in track_edges), dtype=np.float64,
+                            count=len(track_edges))
+    return length, max_speed, departure
+
+
+def constant_velocities(length: np.ndarray, max_speed: np.ndarray, stops: np.ndarray, train: "TrainItem") \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The train runs at the maximum speed of every edge with a length, edges without length keep the velocity of the
+    previous edge, which is 0 after a stop.
+    @return: Average velocity and end velocity per edge
+    """
+    max_train_v = np.minimum(max_speed, train.train_speed)
+    has_length = length > 0
+    source = np.maximum.accumulate(np.where(has_length | stops, np.arange(len(length)), -1))
+    velocity = np.where(has_length, max_train_v, 0.0)[np.maximum(source, 0)]
+    velocity = np.where(source >= 0, velocity, 0.0)
+    return velocity, velocity
+
+
+def accelerating_velocities(length: np.ndarray, max_speed: np.ndarray, stops: np.ndarray, train: "TrainItem") \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as constant_velocities, with the acceleration model of TrainAgentAcceleration. The velocity at the end of an
+    edge depends on the velocity at its start, so this is one pass over the route.
+    """
+    velocity = np.empty(len(length))
+    end_velocity = np.empty(len(length))
+    v = 0.0
+    for i, (l, ms, stop) in enumerate(zip(length.tolist(), max_speed.tolist(), stops.tolist())):
+        if stop:
+            v = 0.0
+        if l > 0:
+            max_train_v = min(ms, train.train_speed)
+            acceleration = train.acceleration if max_train_v > 0 else train.deceleration * -1
+            l_min = ((max_train_v ** 2) - (v ** 2)) / (2 * acceleration)
+            if l_min >= l:
+                train_v = (v + math.sqrt((v ** 2) + 2 * acceleration * l)) / 2
+                v = v + (l / train_v) * acceleration
+            else:
+                train_v = l / (((max_train_v - v) / acceleration) + ((l - l_min) / max_train_v))
+                v = max_train_v
+            velocity[i] = train_v
+        else:
+            velocity[i] = v
+        end_velocity[i] = v
+    return velocity, end_velocity
+
+
+def blocking_times(length: np.ndarray, max_speed: np.ndarray, departure: np.ndarray, train: "TrainItem",
+                   acceleration=False) -> BlockingTimes:
+    """
+    Calculate the blocking times of all track edges of a route at once.
+    @param length: Length per edge, see route_arrays
+    @param max_speed: Max speed per edge
+    @param departure: Departure time of a stop on the edge, nan if the train does not stop
+    @param acceleration: Use the acceleration model of TrainAgentAcceleration instead of running at the max speed
+    """
+    stops = ~np.isnan(departure)
+    velocities = accelerating_velocities if acceleration else constant_velocities
+    velocity, end_velocity = velocities(length, max_speed, stops, train)
+    has_length = length > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        running = np.where(has_length, length / velocity, 0.0)
+        clearing = np.where(has_length, train.train_length / end_velocity, 0.0)
+        travel = np.where(velocity > 0, length / velocity, 0.0)
+
+    # The time at every edge is the time at the previous edge plus its travel time, which is only reset by a stop.
+    # Accumulate per part between stops, a stop takes (start + station time) as in TrainAgent.calculate_blocking_times
+    n = len(length)
+    start = np.empty(n)
+    station = np.zeros(n)
+    approach_end = np.empty(n)
+    cur_time = train.start_time
+    bounds = np.flatnonzero(stops).tolist()
+    for s, e in zip([0] + bounds, bounds + [n]):
+        if s == e:
+            continue
+        if stops[s]:
+            station[s] = departure[s] - cur_time
+        accumulated = np.add.accumulate(np.concatenate(([cur_time + station[s]], travel[s:e])))
+        start[s] = cur_time
+        start[s + 1:e] = accumulated[1:-1]
+        approach_end[s:e] = accumulated[1:]
+        cur_time = accumulated[-1].item()
+
+    end = np.where(has_length, start + running + clearing + station, start + station) + train.release_time
+    duration = np.where(has_length, running + station, station)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # TODO: create variable from the 1.08
+        recovery = np.where(stops, np.maximum(0.0, station - train.minimum_stop_time),
+                            np.where(has_length, running - length / (velocity * 1.08), 0.0))
+    approach_start = start + station - train.setup_time - train.sight_reaction_time
+    return BlockingTimes(start, end, duration, recovery, approach_start, approach_end, velocity, end_velocity)
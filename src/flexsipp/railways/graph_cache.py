@@ -0,0 +1,176 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+from logging import getLogger
+from multiprocessing.context import BaseContext
+from typing import Any, Optional
+
+from .block_graph import BlockGraph, BlockEdge
+from .track_graph import TrackGraph, TrackNode, TrackEdge, Signal
+from . import block_graph, track_graph
+from ..graphs import frozen_graph, graph
+from ..util import util
+
+logger = getLogger('__main__.' + __name__)
+
+# Increase to invalidate all cached graphs, changes of the CACHE_SOURCES already do so
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".graph.pickle"
+# Modules that read the location, enumerate the blocks (BlockEnumerator on the FrozenGraph) and store the snapshots
+CACHE_SOURCES = (graph.__file__, frozen_graph.__file__, util.__file__, track_graph.__file__, block_graph.__file__,
+                 __file__)
+
+
+def default_cache_dir() -> str:
+    """
+    @return: $FLEXSIPP_CACHE_DIR, or ~/.cache/flexsipp
+    """
+    return os.environ.get("FLEXSIPP_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "flexsipp")
+
+
+def cache_enabled() -> bool:
+    """
+    The cache is only used by graph_from_file when asked for, or when $FLEXSIPP_CACHE_DIR is set.
+    """
+    return bool(os.environ.get("FLEXSIPP_CACHE_DIR"))
+
+
+def cache_key(file) -> str:
+    """
+    Hash of the content of the location file and of the CACHE_SOURCES, so a cached graph is not used anymore when
+    the way the graphs are created or stored changes.
+    """
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for path in CACHE_SOURCES + (file,):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def worker_context(mp_context: Optional[BaseContext] = None) -> BaseContext:
+    """
+    Multiprocessing context of worker processes that use a graph. Forking, where available, shares the graph with
+    the workers. Other start methods pickle the arguments of the workers, and pickling a graph recurses through all
+    references between its nodes and edges, so these workers get a snapshot of the graph instead.
+    @param mp_context: Context to use instead of the default
+    """
+    if mp_context is not None:
+        return mp_context
+    return multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+
+
+def snapshot_track_graph(tg: TrackGraph) -> dict[str, Any]:
+    """
+    Index-based copy of a track graph, only containing lists of strings and numbers.
+    """
+    track_nodes = {n.name: i for i, n in enumerate(tg.nodes.values())}
+    track_edges = {e.id: i for i, e in enumerate(tg.edges)}
+    return {
+        "track_nodes": [(n.name, n.type, n.canReverse, n.stationPlatform,
+                         [track_nodes[o.name] for o in n.opposites], [track_nodes[a.name] for a in n.associated])
+                        for n in tg.nodes.values()],
+        "track_edges": [(track_nodes[e.from_node.name], track_nodes[e.to_node.name], e.length, e.max_speed,
+                         [track_edges[o.id] for o in e.opposites], [track_edges[a.id] for a in e.associated])
+                        for e in tg.edges],
+        "signals": [(s.id, track_nodes[s.track.name]) for s in tg.signals],
+        "distance_markers": dict(tg.distance_markers),
+        "stations": {station: (a.name, b.name) for station, (a, b) in tg.stations.items()},
+    }
+
+
+def restore_track_graph(data: dict[str, Any]) -> TrackGraph:
+    """
+    Create the track graph of a snapshot_track_graph, in the same order as TrackGraph.read_graph.
+    """
+    tg = TrackGraph()
+    nodes: list[TrackNode] = []
+    for name, node_type, can_reverse, station_platform, _, _ in data["track_nodes"]:
+        n = tg.add_node(TrackNode(name, node_type))
+        n.canReverse = can_reverse
+        n.stationPlatform = station_platform
+        nodes.append(n)
+    for from_node, to_node, length, max_speed, _, _ in data["track_edges"]:
+        e = tg.add_edge(TrackEdge(nodes[from_node], nodes[to_node], length))
+        e.max_speed = max_speed
+    for n, (_, _, _, _, opposites, associated) in zip(nodes, data["track_nodes"]):
+        n.opposites = [nodes[i] for i in opposites]
+        n.associated = [nodes[i] for i in associated]
+    for e, (_, _, _, _, opposites, associated) in zip(tg.edges, data["track_edges"]):
+        e.opposites = [tg.edges[i] for i in opposites]
+        e.associated = [tg.edges[i] for i in associated]
+    tg.distance_markers = data["distance_markers"]
+    for signal_id, track in data["signals"]:
+        tg.add_signal(Signal(signal_id, nodes[track]))
+    tg.stations = {station: (tg.nodes[a], tg.nodes[b]) for station, (a, b) in data["stations"].items()}
+    return tg
+
+
+def snapshot(g: BlockGraph) -> dict[str, Any]:
+    """
+    snapshot_track_graph of the track graph, together with the block edges.
+    """
+    track_edges = {e.id: i for i, e in enumerate(g.tg.edges)}
+    data = snapshot_track_graph(g.tg)
+    data["block_edges"] = [(e.from_node.name, e.to_node.name, e.length, [track_edges[t.id] for t in e.track_route],
+                            e.direction, e.max_speed) for e in g.edges]
+    return data
+
+
+def restore(data: dict[str, Any]) -> BlockGraph:
+    """
+    Create the graphs of a snapshot, in the same order as TrackGraph.read_graph and BlockGraph.from_track_graph.
+    """
+    tg = restore_track_graph(data)
+    g = BlockGraph(tg)
+    g.add_signal_nodes()
+    for from_node, to_node, length, route, direction, max_speed in data["block_edges"]:
+        g.add_edge(BlockEdge(g.nodes[from_node], g.nodes[to_node], length, [tg.edges[i] for i in route], direction,
+                             max_speed))
+    return g
+
+
+def load_graph(file, cache_dir: Optional[str] = None, workers: Optional[int] = 1) -> BlockGraph:
+    """
+    Read the block graph of a location file from the cache, or create it and add it to the cache.
+    @param cache_dir: Directory of the cache, default_cache_dir() if not given
+    @param workers: Number of processes that create the block graph if it is not in the cache
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    path = os.path.join(cache_dir, cache_key(file) + CACHE_SUFFIX)
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                g = restore(pickle.load(f))
+            logger.info(f"Read graph of {file} from cache {path}")
+            return g
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cached graph {path}: {e}")
+
+    g = BlockGraph.from_track_graph(TrackGraph.read_graph(file), workers)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so a concurrent run never reads a partially written graph
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot(g), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write graph of {file} to cache {cache_dir}: {e}")
+    return g
+
+
+def clear_cache(cache_dir: Optional[str] = None) -> int:
+    """
+    Remove all cached graphs.
+    @return: The number of removed graphs
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith(CACHE_SUFFIX):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
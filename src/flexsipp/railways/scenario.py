@@ -1,15 +1,124 @@
-from typing import Union, Tuple, Any
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from logging import getLogger
+from multiprocessing.context import BaseContext
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Union, Tuple, Any, Optional
 
 import numpy as np
 from matplotlib import cm, patches
 from matplotlib.axis import Axis
 
+from ..graphs.fsipp import FSIPP
 from ..graphs.graph import IntervalStore
+from ..graphs.graph_view import GraphView
 from ..railways.block_graph import BlockGraph, BlockNode, BlockEdge
+from ..railways.graph_cache import restore, snapshot, worker_context
 from ..railways.track_graph import TrackEdge
 from ..railways.train_agent import TrainItem, TrainAgent
+from ..util.intervals import UnsafeInterval
+from ..util.results import Results
 from ..util.timing import timing
 
+logger = getLogger('__main__.' + __name__)
+
+
+@dataclass
+class ReplanResult:
+    agent_id: int
+    # None if the search failed or timed out
+    results: Optional[Results]
+    fsipp_time: float
+    search_time: float
+
+
+# Scenario and agents used by the replanning worker processes, set by _init_replan_worker
+_replan_scenario: Optional["Scenario"] = None
+_replan_agents: list[TrainAgent] = []
+
+
+def _init_replan_worker(scenario: Optional["Scenario"], agents: list[TrainAgent],
+                        data: Optional[dict[str, Any]] = None):
+    """
+    @param scenario: Processed scenario, if it is shared by forking
+    @param agents: Agents to replan
+    @param data: Otherwise the _replan_snapshot of the scenario and agents
+    """
+    global _replan_scenario, _replan_agents
+    if scenario is None and data is not None:
+        scenario, agents = _restore_replan_snapshot(data)
+    _replan_scenario = scenario
+    _replan_agents = agents
+
+
+def _replan_snapshot(scenario: "Scenario", agents: list[TrainAgent]) -> dict[str, Any]:
+    """
+    Index-based copy of a processed scenario, see graph_cache.snapshot: the graph, the unsafe intervals and
+    flexibility of every node/edge, and the route and measures of the agents in the scenario and of the agents to
+    replan.
+    """
+    g = scenario.g
+    edges = {e.id: i for i, e in enumerate(g.edges)}
+
+    def agent_data(agent: TrainAgent) -> Tuple[int, list[int], TrainItem]:
+        return agent.id, [edges[e.id] for e in agent.route], agent.measures
+
+    return {
+        "graph": snapshot(g),
+        "global_end_time": g.global_end_time,
+        "unsafe_interval_store": g.unsafe_interval_store,
+        "interval_stores": [([(i.start, i.end, i.duration, i.by_agent.id, i.local_recovery_time)
+                              for i in ui.unsafe_intervals], ui.bt, ui.crt)
+                            for ui in list(g.nodes.values()) + g.edges],
+        "agents": [agent_data(a) for a in scenario.agents],
+        "replan_agents": [agent_data(a) for a in agents],
+    }
+
+
+def _restore_replan_snapshot(data: dict[str, Any]) -> Tuple["Scenario", list[TrainAgent]]:
+    """
+    Create the processed scenario and the agents to replan of a _replan_snapshot. The agents are TrainAgents, their
+    own class is only needed to process the scenario.
+    """
+    g = restore(data["graph"])
+    g.set_unsafe_interval_store(data["unsafe_interval_store"])
+    g.global_end_time = g.tg.global_end_time = data["global_end_time"]
+
+    def agent(agent_id: int, route: list[int], measures: TrainItem) -> TrainAgent:
+        return TrainAgent(agent_id, [g.edges[i] for i in route], measures)
+
+    agents = [agent(*a) for a in data["agents"]]
+    by_id = {a.id: a for a in agents}
+    for ui, (intervals, bt, crt) in zip(list(g.nodes.values()) + g.edges, data["interval_stores"]):
+        ui.unsafe_intervals = g.unsafe_interval_store([UnsafeInterval(start, end, duration, by_id[agent_id], recovery)
+                                                       for start, end, duration, agent_id, recovery in intervals])
+        ui.bt, ui.crt = bt, crt
+        ui.merged = True
+
+    # The scenario is already processed, so it is not created from the scenario data
+    scenario = object.__new__(Scenario)
+    scenario.types = {}
+    scenario.g = g
+    scenario.agents = agents
+    return scenario, [agent(*a) for a in data["replan_agents"]]
+
+
+def _replan_agent(index: int, timeout: float, directory: str) -> ReplanResult:
+    agent = _replan_agents[index]
+    ts = perf_counter()
+    flexSIPP = _replan_scenario.create_fsipp(agent)
+    te = perf_counter()
+    try:
+        results = flexSIPP.run_search(timeout, agent.origin.name, agent.destination.name, agent.measures.start_time,
+                                      file=os.path.join(directory, f"flexsipp_{index}.txt"))
+    except RuntimeError:
+        logger.error(f"Replanning agent {agent.id} failed")
+        results = None
+    return ReplanResult(agent.id, results, te - ts, perf_counter() - te)
+
 
 class Scenario:
     @timing
@@ -72,6 +181,38 @@ class Scenario:
         for agent in self.agents:
             agent.calculate_flexibility()
 
+    @timing
+    def update_agent(self, agent: TrainAgent) -> set[IntervalStore]:
+        """
+        Update the processed scenario after the schedule (start time or stop times) of one agent changed, without
+        processing the whole scenario again. Only the unsafe intervals of the blocks on the old and new route of the
+        agent are recalculated, together with the flexibility of the agents that pass these blocks.
+        @param agent: Changed agent, replaces the agent with the same id (can also be the same, modified object)
+        @return: Nodes/edges of which the unsafe intervals or flexibility changed, can be passed to FSIPP.update
+        """
+        index = next(i for i, a in enumerate(self.agents) if a.id == agent.id)
+        old_agent = self.agents[index]
+        self.agents[index] = agent
+
+        # The old agent can be the same object with a different route, so use the route its intervals were added for
+        changed = old_agent.blocked_interval_stores() | agent.route_interval_stores()
+        for ui in changed:
+            ui.remove_agent(old_agent)
+        agent.calculate_blocking_times()
+        for ui in changed:
+            ui.merge_unsafe_intervals()
+
+        # The flexibility of an agent depends on the unsafe intervals after its own on its route
+        affected = [a for a in self.agents if a is agent or any(block in changed for block in a.route)]
+        for a in affected:
+            stores = a.route_interval_stores()
+            for ui in stores:
+                ui.remove_flexibility(a)
+            changed |= stores
+        for a in affected:
+            a.calculate_flexibility()
+        return changed
+
     def get_replanning_agent(self, a: Union[TrainAgent, int]) -> TrainAgent:
         if isinstance(a, int):
             return self.agents[a - 1]
@@ -94,9 +235,72 @@ class Scenario:
             ui.unsafe_intervals = ui.filter_out_agent(agent)
         for e in g.edges:
             e.length = e.length / agent.measures.train_speed
+        # Edge lengths are now in time, the cached shortest paths no longer hold
+        g.invalidate_shortest_paths()
 
         return g
 
+    @timing
+    def fsipp_view(self, agent: Union[TrainAgent, int]) -> GraphView[BlockEdge, BlockNode]:
+        """
+        Create a view on the BlockGraph that can be used by FSIPP, without modifying the BlockGraph.
+        The view leaves out the unsafe intervals of the agent and has edge lengths in time instead of distance,
+        so FSIPP instances can be created for any number of agents from the same processed scenario.
+        @param agent: Agent_id to filter out, or a new agent in the simulation.
+        @return: View of the BlockGraph for agent
+        """
+        agent = self.get_replanning_agent(agent)
+        assert agent is not None
+        return GraphView(self.g, agent, agent.measures.train_speed)
+
+    def create_fsipp(self, agent: Union[TrainAgent, int], prune=True) -> FSIPP[BlockEdge, BlockNode]:
+        """
+        Create the FSIPP graph to replan agent, using a view on the BlockGraph and the
+        time-distance to the destination of agent as heuristic.
+        @param agent: Agent_id to replan, or a new agent in the simulation.
+        @param prune: Only include the blocks that are on some path from the origin to the destination of agent
+        """
+        agent = self.get_replanning_agent(agent)
+        view = self.fsipp_view(agent)
+        # Same edge weights as the view (distance / train speed), so the heuristic does not overestimate
+        distances = self.g.calculate_heuristics([agent.destination], None)[0] / agent.measures.train_speed
+        heuristic = dict(zip(self.g.freeze().names(), distances.tolist()))
+        if prune:
+            return FSIPP(view, heuristic, agent.origin.name, agent.destination.name)
+        return FSIPP(view, heuristic)
+
+    def replan_all(self, agents: Optional[list[Union[TrainAgent, int]]] = None, workers: Optional[int] = None,
+                   timeout: float = 1000, directory: Optional[str] = None,
+                   mp_context: Optional[BaseContext] = None) -> list[ReplanResult]:
+        """
+        Replan every agent with flexSIPP, distributing the FSIPP construction and searches over a process pool.
+        Workers that are not forked get a _replan_snapshot of the processed scenario.
+        @param agents: Agents (or agent_ids) to replan, all agents in the scenario if None
+        @param workers: Number of worker processes, defaults to the number of CPUs. 1 runs in the current process.
+        @param timeout: Timeout in seconds of a single search
+        @param directory: Directory to write the FSIPP graphs to, a temporary directory if None
+        @param mp_context: Multiprocessing context of the workers, see graph_cache.worker_context
+        @return: The results and timing per agent, in the order of agents
+        """
+        agents = self.agents if agents is None else [self.get_replanning_agent(a) for a in agents]
+        with TemporaryDirectory() if directory is None else nullcontext(directory) as directory:
+            indices = range(len(agents))
+            if workers == 1:
+                _init_replan_worker(self, agents)
+                try:
+                    return [_replan_agent(i, timeout, directory) for i in indices]
+                finally:
+                    _init_replan_worker(None, [])
+
+            mp_context = worker_context(mp_context)
+            if mp_context.get_start_method() == "fork":
+                initargs = (self, agents)
+            else:
+                initargs = (None, [], _replan_snapshot(self, agents))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                     initializer=_init_replan_worker, initargs=initargs) as pool:
+                return list(pool.map(_replan_agent, indices, [timeout] * len(agents), [directory] * len(agents)))
+
     def plot_blocking_staircase(self, ax: Axis, agent: Union[TrainAgent, int], **kwargs):
         agent = self.get_replanning_agent(agent)
         track_edges_to_plot: dict[TrackEdge, Tuple[float, float]] = {}
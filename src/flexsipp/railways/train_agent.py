@@ -1,4 +1,5 @@
-from typing import Tuple
+import itertools
+from typing import Optional, Tuple
 
 from dataclasses import dataclass
 from matplotlib.axis import Axis
@@ -6,6 +7,7 @@ from matplotlib.axis import Axis
 from ..agent import Agent
 from ..graphs.graph import IntervalStore
 from ..railways.block_graph import BlockEdge, BlockNode
+from ..railways.blocking_times import BlockingTimes, blocking_times, route_arrays
 from ..railways.track_graph import TrackEdge
 from ..util.intervals import UnsafeInterval
 
@@ -31,107 +33,114 @@ class TrainAgent(Agent[BlockEdge, BlockNode]):
     def __init__(self, id:int, route: list[BlockEdge], train: TrainItem):
         super().__init__(id, route)
         self.measures = train
-
-    def _occupation_time(self, e: TrackEdge, velocity: float, cur_time: float, station_time: float) -> Tuple[UnsafeInterval, float, float]:
-        if e.length > 0:
-            max_train_v = min(e.max_speed, self.measures.train_speed)
-            clearing_time = self.measures.train_length / max_train_v
-            end_occupation_time = cur_time + e.length / max_train_v + clearing_time + station_time
-
-            if self.id in e.stops_at_station:
-                recovery_time = max(0.0, station_time - self.measures.minimum_stop_time)
-            else:
-                # TODO: create variable from the 1.08
-                recovery_time = (e.length / max_train_v) - e.length / (max_train_v * 1.08)
-
-            return UnsafeInterval(
-                cur_time,
-                end_occupation_time + self.measures.release_time,
-                e.length / max_train_v + station_time,
-                self,
-                recovery_time
-            ), max_train_v, max_train_v
-
-        else:
-            end_train_v = velocity
-            end_occupation_time = cur_time + station_time
-
-            # Recovery time calculation
-            if self.id in e.stops_at_station:
-                recovery_time = max(0.0, station_time - self.measures.minimum_stop_time)
-            else:
-                recovery_time = 0
-
-            return UnsafeInterval(
-                cur_time,
-                end_occupation_time + self.measures.release_time,
-                station_time,
-                self,
-                recovery_time
-            ), velocity, end_train_v
-
-    def _approach_time(self, e: TrackEdge, avg_v: float, cur_time: float, station_time: float) -> Tuple[UnsafeInterval, set[IntervalStore]]:
-        start_approach_time = cur_time + station_time - self.measures.setup_time - self.measures.sight_reaction_time
-
-        end_approach_time = cur_time + station_time
-        if avg_v > 0:
-            end_approach_time += (e.length / avg_v)
-
-        interval = UnsafeInterval(
-            start_approach_time,
-            end_approach_time,
-            0,
-            self,
-            0.0
-        )
-
+        # Index of the first block of the route per track edge, and distance to the start of every block
+        self._route_index: dict[TrackEdge, int] = {}
+        self._route_offsets: list[float] = []
+        # Route at the last calculate_blocking_times, the unsafe intervals of the agent are on the blocks of this route
+        self._blocked_route: list[BlockEdge] = []
+        self._set_route_index()
+
+    def _approach_blocks(self, e: TrackEdge, avg_v: float) -> set[IntervalStore]:
+        """
+        @return: Nodes/edges of the block graph that are blocked during the approach time of track edge e
+        """
         # Find current spot in block graph
-        bools = [e in block.track_route for block in self.route]
-        current_path_index = bools.index(True) if True in bools else None
+        current_path_index = self._route_index.get(e)
 
         approach_blocks: set[IntervalStore] = set()
-        # TODO make variable and fix values > 2 in regards to station time, or even better:
-        #  change it to actually use the breaking distance of the train at the current time.
-        n_blocks = 0
-
         if current_path_index is not None:
+            n_blocks = self._approach_block_count(current_path_index, avg_v)
             for path_block in self.route[current_path_index:current_path_index + n_blocks]:
                 for path_edge in path_block.track_route:
-                    approach_blocks.union(path_edge.blocks)
-
-        return interval, approach_blocks
-
+                    approach_blocks.update(path_edge.blocks)
+        return approach_blocks
+
+    def _approach_block_count(self, route_index: int, velocity: float) -> int:
+        """
+        @param route_index: Index in the route of the block the train is on
+        @param velocity: Velocity of the train on the current track
+        @return: Number of blocks from the current block onwards that are also blocked during the approach time
+        """
+        # TODO make variable and fix values > 2 in regards to station time, see TrainAgentBrakingDistance for a
+        #  window that uses the braking distance of the train at the current time.
+        return 0
+
+    def _set_route_index(self):
+        """
+        Map every track edge of the route to the index of the first block of the route that it is part of, and store
+        the distance from the start of the route to the start of every block. Done again when calculating the blocking
+        times, in case the route changed.
+        """
+        self._route_index = {}
+        for i, block_e in enumerate(self.route):
+            for e in block_e.track_route:
+                self._route_index.setdefault(e, i)
+        self._route_offsets = list(itertools.accumulate((block_e.length for block_e in self.route),
+                                                        initial=0.0))
+
+    def route_interval_stores(self, route: Optional[list[BlockEdge]] = None) -> set[IntervalStore]:
+        """
+        @param route: Route to use instead of the current route of the agent
+        @return: All nodes/edges of the block graph that the unsafe intervals and flexibility of this agent are added to
+        """
+        return {block for block_e in (self.route if route is None else route) for e in block_e.track_route
+                for block in block_e.from_node.graph.conflict_index[e].interval_stores}
+
+    def blocked_interval_stores(self) -> set[IntervalStore]:
+        """
+        Same as route_interval_stores, for the route at the last calculate_blocking_times. The route of the agent can
+        have changed since.
+        """
+        return self.route_interval_stores(self._blocked_route)
+
+    def _blocking_times(self, track_edges: list[TrackEdge]) -> BlockingTimes:
+        """
+        Override this to change how the train runs over its route, see TrainAgentAcceleration. The occupation and
+        approach intervals that calculate_blocking_times adds are made from the returned times.
+        @return: Blocking times of the track edges of the route
+        """
+        return blocking_times(*route_arrays(track_edges, self.id), self.measures)
 
     # TODO: Maybe make this overwrite a function of Agent
     def calculate_blocking_times(self):
         cur_time = self.measures.start_time
-        velocity = 0.0
+        self._set_route_index()
+        self._blocked_route = list(self.route)
+
+        track_edges = [e for block_e in self.route for e in block_e.track_route]
+        times = self._blocking_times(track_edges)
+        intervals = zip(times.start.tolist(), times.end.tolist(), times.duration.tolist(), times.recovery.tolist(),
+                        times.approach_start.tolist(), times.approach_end.tolist(), times.velocity.tolist())
 
+        # Unsafe intervals per node/edge, added at once after going over the route
+        unsafe_intervals: dict[IntervalStore, list[UnsafeInterval]] = {}
         for block_e in self.route:
+            conflict_index = block_e.from_node.graph.conflict_index
             block_e.add_start_time(self, cur_time)
             for e in block_e.track_route:
-                for e_opp in e.opposites + e.associated + [e]:
+                start, end, duration, recovery, approach_start, approach_end, avg_v = next(intervals)
+                interval_stores, plotting_edges = conflict_index[e]
+                for e_opp in plotting_edges:
                     e_opp.add_start_time(self, cur_time)
-                station_time = 0
-                if self.id in e.stops_at_station:
-                    station_time = e.stops_at_station[self.id] - cur_time
-                    velocity = 0
-
-                occupation_time, avg_v, velocity = self._occupation_time(e, velocity, cur_time, station_time)
 
-                for block in e.blocks.union(e.from_node.blocks):
-                    block.add_unsafe_interval(occupation_time)
+                occupation_time = UnsafeInterval(start, end, duration, self, recovery)
+                for block in interval_stores:
+                    unsafe_intervals.setdefault(block, []).append(occupation_time)
 
-                approach_interval, approach_blocks = self._approach_time(e, avg_v, cur_time, station_time)
+                approach_blocks = self._approach_blocks(e, avg_v)
+                if approach_blocks:
+                    approach_interval = UnsafeInterval(approach_start, approach_end, 0, self, 0.0)
+                    for block in approach_blocks:
+                        unsafe_intervals.setdefault(block, []).append(approach_interval)
 
-                for block in approach_blocks:
-                    block.add_unsafe_interval(approach_interval)
-
-                cur_time = approach_interval.end
-                for e_opp in e.opposites + e.associated + [e]:
+                cur_time = approach_end
+                for e_opp in plotting_edges:
                     e_opp.add_end_time(self, cur_time)
             block_e.add_end_time(self, cur_time)
 
+        for block, block_intervals in unsafe_intervals.items():
+            block.add_unsafe_intervals(block_intervals)
+
     def plot_route(self, ax: Axis, edges_to_plot: dict[TrackEdge, Tuple[float, float]], color):
         for block in self.route:
             for edge in block.track_route:
@@ -0,0 +1,17 @@
+import bisect
+
+from ...railways.train_agent import TrainAgent
+
+
+class TrainAgentBrakingDistance(TrainAgent):
+    """
+    Blocks the blocks ahead of the train that are within its braking distance v^2 / (2 * deceleration) during the
+    approach time, instead of only the blocks of the track it is on.
+    """
+    def _approach_block_count(self, route_index: int, velocity: float) -> int:
+        if velocity <= 0 or self.measures.deceleration <= 0:
+            return 0
+        braking_distance = velocity ** 2 / (2 * self.measures.deceleration)
+        # Smallest number of blocks from the start of the current block that covers the braking distance
+        end = bisect.bisect_left(self._route_offsets, self._route_offsets[route_index] + braking_distance)
+        return min(end, len(self.route)) - route_index
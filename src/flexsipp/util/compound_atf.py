@@ -0,0 +1,82 @@
+from typing import Union
+
+import numpy as np
+
+Times = Union[float, np.ndarray]
+
+
+def _scalar_or_array(t, arrival: np.ndarray) -> Times:
+    return float(arrival) if np.ndim(t) == 0 else arrival
+
+
+class CompoundATF(object):
+    """
+    Piecewise linear compound ATF of a search: departing at x in [x0, x1] of a segment arrives at the linear
+    interpolation between y0 and y1. The segments are sorted and bumper to bumper, like CompoundATF in search/atf.hpp.
+    """
+    __slots__ = ("x0", "x1", "y0", "y1", "slope")
+
+    def __init__(self, segments: np.ndarray):
+        """
+        @param segments: Rows of (x0, x1, y0, y1), see Results.catf_values
+        """
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self.x0, self.x1, self.y0, self.y1 = (np.ascontiguousarray(column) for column in segments.T)
+        # Segments with an infinite width or arrival are constant
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = (self.y1 - self.y0) / (self.x1 - self.x0)
+        self.slope = np.where(np.isfinite(slope), slope, 0.0)
+
+    def __len__(self):
+        return len(self.x0)
+
+    def arrival_time(self, t: Times) -> Times:
+        """
+        @param t: Departure time(s)
+        @return: Earliest arrival time(s) when departing at t, inf if there is no path at t
+        """
+        times = np.asarray(t, dtype=np.float64)
+        if len(self) == 0:
+            return _scalar_or_array(t, np.full(times.shape, np.inf))
+        # First segment that ends at or after t, at a breakpoint this is the lower of the two segments
+        i = np.minimum(np.searchsorted(self.x1, times, side="left"), len(self) - 1)
+        x0 = self.x0[i]
+        with np.errstate(invalid="ignore"):
+            arrival = np.where(self.slope[i] == 0, self.y0[i], self.y0[i] + (times - x0) * self.slope[i])
+        arrival = np.where((times < x0) | (times > self.x1[i]), np.inf, arrival)
+        return _scalar_or_array(t, arrival)
+
+    def __repr__(self):
+        return f"CompoundATF with {len(self)} segments"
+
+
+class PathATF(object):
+    """
+    Arrival time function of a single path, the lower envelope of its distinct edge ATFs (zeta, alpha, beta, delta).
+    """
+    __slots__ = ("zeta", "alpha", "beta", "delta")
+
+    def __init__(self, eatfs: np.ndarray):
+        """
+        @param eatfs: Rows of (zeta, alpha, beta, delta), see Results.unique_path_eatf_values
+        """
+        eatfs = np.asarray(eatfs, dtype=np.float64).reshape(-1, 4)
+        self.zeta, self.alpha, self.beta, self.delta = (np.ascontiguousarray(column) for column in eatfs.T)
+
+    def __len__(self):
+        return len(self.zeta)
+
+    def arrival_time(self, t: Times) -> Times:
+        """
+        Same as EdgeATF::inclusive_arrival_time in search/atf.hpp, minimised over the edge ATFs of the path.
+        A path only has a few distinct edge ATFs, so they are all evaluated at once.
+        @param t: Departure time(s)
+        @return: Earliest arrival time(s) over this path when departing at t, inf if the path can not be taken at t
+        """
+        times = np.asarray(t, dtype=np.float64)[..., np.newaxis]
+        arrival = np.where(times < np.minimum(self.alpha, self.beta), self.alpha + self.delta, times + self.delta)
+        arrival = np.where((times < self.zeta) | (times > self.beta), np.inf, arrival)
+        return _scalar_or_array(t, arrival.min(axis=-1, initial=np.inf))
+
+    def __repr__(self):
+        return f"PathATF with {len(self)} edge ATFs"
@@ -1,15 +1,13 @@
-from copy import copy
-
 from ..agent import Agent
 
 class Interval:
-    index = 0
+    __slots__ = ("start", "end", "index")
 
-    def __init__(self, start: float, end:float):
+    def __init__(self, start: float, end:float, index: int = -1):
         self.start = start
         self.end = end
-        self.index = Interval.index
-        Interval.index += 1
+        # Id of the interval within its graph (see Graph.interval_ids), -1 if it has none
+        self.index = index
 
     def __iter__(self):
         yield self.start
@@ -34,13 +32,19 @@ class Interval:
         @param other: An overlapping interval
         @return: an Interval encompassing both the current and the other interval
         """
-        if self & other:
+        if self.overlaps(other):
             return Interval(min(self.start, other.start), max(self.end, other.end))
         raise ValueError
 
     def __and__(self, other):
         return Interval(max(self.start, other.start), min(self.end, other.end))
 
+    def overlaps(self, other) -> bool:
+        """
+        Same as bool(self & other), without creating the intersection
+        """
+        return max(self.start, other.start) <= min(self.end, other.end)
+
     def __eq__(self, other):
         if isinstance(other, Interval):
             return self.start == other.start and self.end == other.end
@@ -58,6 +62,8 @@ class Interval:
 
 
 class UnsafeInterval(Interval):
+    __slots__ = ("duration", "by_agent", "local_recovery_time")
+
     def __init__(self, start, end, duration: float, by_agent: Agent, local_recovery_time: float):
         super().__init__(start, end)
         self.duration = duration
@@ -81,8 +87,11 @@ class UnsafeInterval(Interval):
         assert self.by_agent == other.by_agent
 
 class SafeInterval(Interval):
-    def __init__(self, start, end, agent_before: Agent, crt_before: float, agent_after: Agent, buffer_after: float, crt_after: float):
-        super().__init__(start, end)
+    __slots__ = ("agent_before", "crt_before", "agent_after", "buffer_after", "crt_after")
+
+    def __init__(self, start, end, agent_before: Agent, crt_before: float, agent_after: Agent, buffer_after: float, crt_after: float,
+                 index: int = -1):
+        super().__init__(start, end, index)
         self.agent_before = agent_before
         self.crt_before = crt_before
         self.agent_after = agent_after
@@ -106,11 +115,17 @@ class SafeInterval(Interval):
 
 
 class ArrivalTimeFunction:
+    """
+    ATF of a single connection, the FSIPP graph creates these for all connections at once in an ATFTable.
+    The trains are given by their id, like in ATFTable.
+    """
+    __slots__ = ("from_id", "to_id", "train_before", "train_after", "zeta", "alpha", "beta", "delta")
+
     def __init__(self, from_interval: SafeInterval, edge_interval: SafeInterval, to_interval: SafeInterval, delta: float):
         self.from_id = from_interval.index
         self.to_id   = to_interval.index
-        self.train_before = self._check_agent(edge_interval.agent_before)
-        self.train_after  = self._check_agent(edge_interval.agent_after)
+        self.train_before = self._agent_id(edge_interval.agent_before)
+        self.train_after  = self._agent_id(edge_interval.agent_after)
 
         self.zeta = from_interval.start
         self.alpha = max(from_interval.start, edge_interval.start, to_interval.start - delta)
@@ -118,17 +133,16 @@ class ArrivalTimeFunction:
         self.delta = delta
 
     @staticmethod
-    def _check_agent(agent):
-        if isinstance(agent, Agent):
-            return agent
-        if agent == 0:
-            return Agent(0, [])
+    def _agent_id(agent):
+        return agent.id if isinstance(agent, Agent) else agent
 
     def __bool__(self) -> bool:
         return self.zeta <= self.alpha < self.beta
 
 
 class FlexibleArrivalTimeFunction(ArrivalTimeFunction):
+    __slots__ = ("buffer_after", "crt_after", "crt_before", "heuristic")
+
     def __init__(self, from_interval: SafeInterval, edge_interval: SafeInterval, to_interval: SafeInterval, delta: float, heuristic: float):
         super().__init__(from_interval, edge_interval, to_interval, delta)
 
@@ -141,9 +155,3 @@ class FlexibleArrivalTimeFunction(ArrivalTimeFunction):
 
     def __repr__(self):
         return f"{self.from_id} {self.to_id} {self.zeta} {self.alpha} {self.beta} {self.delta} {self.train_before} {self.crt_before} {self.train_after} {self.buffer_after} {self.crt_after} {self.heuristic}"
-
-    def replace_index(self, interval_index_map: dict[int, int]) -> "FlexibleArrivalTimeFunction":
-        new_atf = copy(self)
-        new_atf.from_id = interval_index_map[self.from_id]
-        new_atf.to_id = interval_index_map[self.to_id]
-        return new_atf
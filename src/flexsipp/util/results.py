@@ -1,61 +1,74 @@
+import math
+from typing import Iterable, Tuple
+
+import numpy as np
 from matplotlib.axis import Axis
 
+from .compound_atf import CompoundATF, PathATF
+
 
 class Results:
-    def __init__(self, s:str):
+    def __init__(self, s: str = ""):
         #s is a string with the text output of a repeat search this parses it into the compount atf, and the individual augmentded SIPP plans for each segment
-        self.metadata= {}
+        self.metadata = {}
         self.unique_paths = {}
         self.unique_path_eatfs = {}
-        s = s.splitlines() # avoid empty element in list
-        self.parse_list_of_outputs(s)
-
-    def parse_list_of_outputs(self, s, offset=0):
-        # s is the output split on newline characters
-        i = 0
-        while "Nodes generated" not in s[i]:
-            i += 1
-        lns = s[i].split(" ")
-        self.metadata["Nodes generated"] = lns[2]
-        self.metadata["Nodes decreased"] = lns[5]
-        self.metadata["Nodes expanded"] = lns[8]
-        i+=1
-        self.catf = s[i].strip(", ").split(", ") # avoid empty element in list
-        self.catf = [tuple([str(round(float(y) - offset, 2)) for y in (x.strip("'").strip("<").strip(">").split(","))]) for x in self.catf]
-        i += 1
-        paths = []
-        eatfs = []
-        while i < len(s) and "time: " not in s[i]:
-            paths.append([])
-            while "time: " not in s[i] and (s[i][0] != "<") and (s[i][-1] != ">"):
-                # s[i]: "node_name node_safe_interval node_id"
-                paths[-1].append(s[i].split(" ")[0])
-                i += 1
-            atf = s[i]
-            atf = atf.strip("<").strip(">").split(",")
-            gammas = [gamma[1:-1].split(": ") for gamma in atf[-1][1:-1].split("; ")[0:-1]]
-            atf[-1] = gammas
-            for j in range(len(atf) - 2):
-                atf[j] = str(round(float(atf[j]) - offset, 2))
-            atf = tuple(atf)
-            eatfs.append(atf)
-            i += 1
-
-        search_time = s[i].split(" ")
-        self.metadata["Search time"] = search_time[-2]
-
-        if [] in paths:
-            paths.remove([]) # because the last path added stays empty
-
-        for (i,p) in enumerate(paths):
-            path_string = ";".join(p)
-            if path_string in self.unique_paths:
-                self.unique_paths[path_string] += 1
-                if eatfs[i] not in self.unique_path_eatfs[path_string]:
-                    self.unique_path_eatfs[path_string].append(eatfs[i])
-            else:
-                self.unique_paths[path_string] = 1
-                self.unique_path_eatfs[path_string] = [eatfs[i]]
+        self.catf = []
+        # Numeric versions of catf, rows of (x0, x1, y0, y1) segments, and of unique_path_eatfs, rows of
+        # (zeta, alpha, beta, delta)
+        self.catf_values = np.empty((0, 4))
+        self.unique_path_eatf_values: dict[str, np.ndarray] = {}
+        # Arrival time lookups on the numeric breakpoints
+        self.compound_atf = CompoundATF(self.catf_values)
+        self.unique_path_atfs: dict[str, PathATF] = {}
+        if s:
+            self.parse_list_of_outputs(s.splitlines())
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], offset=0) -> "Results":
+        """
+        Parse the output of a search while it is being read, e.g. from the stdout pipe of the search or an open file.
+        @param lines: Lines of the output, with or without line endings
+        """
+        results = cls()
+        results.parse_list_of_outputs(lines, offset)
+        return results
+
+    @classmethod
+    def from_file(cls, file, offset=0) -> "Results":
+        with open(file, "rt") as f:
+            return cls.from_lines(f, offset)
+
+    def parse_list_of_outputs(self, s: Iterable[str], offset=0):
+        # s is the output split on newline characters, every line is only looked at once
+        parser = ResultsParser(self, offset)
+        for line in s:
+            parser.feed(line)
+            if parser.done:
+                break
+        parser.finish()
+
+    def arrival_time(self, t):
+        """
+        @param t: Departure time or array of departure times
+        @return: Earliest arrival time(s) according to the compound ATF
+        """
+        return self.compound_atf.arrival_time(t)
+
+    @staticmethod
+    def _parse_eatf(line: str, offset=0) -> Tuple[tuple, np.ndarray]:
+        """
+        @param line: "<zeta,alpha,beta,delta,[gammas]>"
+        @return: The eatf with numbers rounded as strings and the gammas split, and the (zeta, alpha, beta, delta) values
+        """
+        atf = line.strip("<").strip(">").split(",")
+        values = np.array([float(x) for x in atf[:4] if not x.startswith("[")])
+        values[:3] -= offset
+        gammas = [gamma[1:-1].split(": ") for gamma in atf[-1][1:-1].split("; ")[0:-1]]
+        atf[-1] = gammas
+        for j in range(len(atf) - 2):
+            atf[j] = str(round(float(atf[j]) - offset, 2))
+        return tuple(atf), values
 
     linestyles = [
         (0, (5, 10)),
@@ -72,13 +85,98 @@ class Results:
         y_offset = kwargs.get('y_offset', 0)
 
         line = None
-        for (x0, x1, y0, y1) in self.catf:
-            if x0 == "-inf" and x1 != "inf" and y1 != "inf":
-                ax.hlines(float(y1) + y_offset, 0, float(x1), colors=color, linestyle=linestyle)
-            line, = ax.plot([float(x0), float(x1)], [float(y0) + y_offset, float(y1) + y_offset], color=color,
-                            linestyle=linestyle)
+        for (x0, x1, y0, y1) in self.catf_values.tolist():
+            if x0 == -math.inf and x1 != math.inf and y1 != math.inf:
+                ax.hlines(y1 + y_offset, 0, x1, colors=color, linestyle=linestyle)
+            line, = ax.plot([x0, x1], [y0 + y_offset, y1 + y_offset], color=color, linestyle=linestyle)
         line.set_label(label) if line is not None else None
 
+
+class ResultsParser:
+    """
+    Parses the output of a search into a Results one line at a time, so the output can be parsed while it is read
+    without keeping it, see Results.from_lines and FSIPP.run_search_async.
+    """
+    def __init__(self, results: Results, offset=0):
+        self.results = results
+        self.offset = offset
+        # Part of the output the next line is in: the debug output before the results, the catf, the paths or done
+        self._state = "header"
+        self._path: list[str] = []
+        self._eatf_values: dict[str, list[np.ndarray]] = {}
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the end of the results is read, the rest of the output is not needed.
+        """
+        return self._state == "done"
+
+    def feed(self, line: str):
+        """
+        @param line: Next line of the output, with or without line ending
+        """
+        line = line.rstrip("\r\n")
+        r = self.results
+        if self._state == "header":
+            if "Nodes generated" in line:
+                lns = line.split(" ")
+                r.metadata["Nodes generated"] = lns[2]
+                r.metadata["Nodes decreased"] = lns[5]
+                r.metadata["Nodes expanded"] = lns[8]
+                self._state = "catf"
+        elif self._state == "catf":
+            catf = [x.strip("'").strip("<").strip(">").split(",") for x in line.strip(", ").split(", ")] # avoid empty element in list
+            r.catf = [tuple([str(round(float(y) - self.offset, 2)) for y in x]) for x in catf]
+            r.catf_values = np.array([[float(y) for y in x[:4]] for x in catf]).reshape(-1, 4)
+            # All four values of a segment are times
+            r.catf_values -= self.offset
+            self._state = "paths"
+        elif self._state == "paths":
+            if "time: " in line:
+                search_time = line.split(" ")
+                r.metadata["Search time"] = search_time[-2]
+                self._state = "done"
+            elif not line:
+                return
+            elif line[0] != "<" and line[-1] != ">":
+                # line: "node_name node_safe_interval node_id"
+                self._path.append(line.split(" ")[0])
+            else:
+                # The eatf closes the path, the eatf without a path at the end of the output is skipped
+                if self._path:
+                    self._add_eatf(";".join(self._path), line)
+                self._path = []
+
+    def _add_eatf(self, path_string: str, line: str):
+        r = self.results
+        eatf, values = Results._parse_eatf(line, self.offset)
+        if path_string in r.unique_paths:
+            r.unique_paths[path_string] += 1
+            if eatf not in r.unique_path_eatfs[path_string]:
+                r.unique_path_eatfs[path_string].append(eatf)
+                self._eatf_values[path_string].append(values)
+        else:
+            r.unique_paths[path_string] = 1
+            r.unique_path_eatfs[path_string] = [eatf]
+            self._eatf_values[path_string] = [values]
+
+    def finish(self) -> Results:
+        """
+        Create the numeric versions of the parsed results.
+        @return: The results
+        """
+        if self._state == "header":
+            raise ValueError("Search output does not contain results")
+        if self._state == "catf":
+            raise ValueError("Search output ends before the compound ATF")
+        r = self.results
+        r.unique_path_eatf_values = {p: np.array(v).reshape(-1, 4) for p, v in self._eatf_values.items()}
+        r.compound_atf = CompoundATF(r.catf_values)
+        r.unique_path_atfs = {p: PathATF(v) for p, v in r.unique_path_eatf_values.items()}
+        return r
+
+
 def test():
     Results(
         "\n".join(['Arrival time: 130.667',
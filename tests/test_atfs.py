@@ -1,8 +1,12 @@
 import unittest
 from copy import copy
+from dataclasses import replace
 
 from flexsipp.generate import graph_from_file, scenario_from_file
-from flexsipp.graphs.fsipp import FSIPP
+from flexsipp.graphs.atf_table import ATFTable, alpha_beta, connection_values
+from flexsipp.graphs.fsipp import FSIPP, relevant_nodes
+from flexsipp.graphs.graph import Graph, Node, Edge
+from flexsipp.util.intervals import FlexibleArrivalTimeFunction
 from flexsipp.railways.train_agents.train_agent_limited_flexiblity import train_agent_limited_flexibility_generator
 
 
@@ -25,6 +29,181 @@ class TestFSIPP(unittest.TestCase):
             self.assertTrue(atf.from_id in safe_node_interval_ids)
             self.assertTrue(atf.to_id in safe_node_interval_ids)
 
+    def test_dense_interval_ids(self):
+        ids = sorted(si.index for ui in list(self.flexSIPP.g.nodes.values()) + self.flexSIPP.g.edges
+                     for si in ui.safe_intervals)
+        self.assertEqual(ids, list(range(len(ids))))
+
+    def test_atf_table(self):
+        connections = [c for node in self.flexSIPP.nodes.values() for c in node.get_safe_connections()]
+        objects = [atf for atf in (FlexibleArrivalTimeFunction(*c, 1.5) for c in connections) if atf]
+        table = ATFTable.from_connections(connections, [1.5] * len(connections))
+        self.assertEqual(len(table), len(objects))
+        for row, atf in zip(table, objects):
+            self.assertTrue(row)
+            self.assertEqual([float(x) for x in repr(row).split(" ")], [float(x) for x in repr(atf).split(" ")])
+        self.assertEqual(repr(table[-1]), repr(table[len(table) - 1]))
+        halves = ATFTable.concatenate([table[:3], table[3:]])
+        self.assertEqual(list(halves.lines()), list(table.lines()))
+        records = table.records()
+        self.assertEqual(records["alpha"].tolist(), table.alpha.tolist())
+        self.assertEqual(len(ATFTable.concatenate([])), 0)
+
+    def test_valid_connections(self):
+        connections = [c for node in self.flexSIPP.g.nodes.values() for c in node.get_safe_connections()]
+        self.assertEqual(alpha_beta(connection_values(connections))[2].tolist(),
+                         [bool(FlexibleArrivalTimeFunction(*c, 0)) for c in connections])
+        self.assertEqual(alpha_beta(connection_values([]))[2].tolist(), [])
+
+class TestSafeConnections(unittest.TestCase):
+
+    @staticmethod
+    def nested_loop_connections(node):
+        # Original implementation of Node.get_safe_connections
+        safe_connections = []
+        for from_interval in node.safe_intervals:
+            for edge in node.outgoing:
+                for edge_interval in edge.safe_intervals:
+                    if from_interval & edge_interval:
+                        for to_interval in edge.to_node.safe_intervals:
+                            if edge_interval & to_interval:
+                                safe_connections.append((from_interval, edge_interval, to_interval, edge.length))
+        return safe_connections
+
+    @staticmethod
+    def identities(connections):
+        return [(id(f), id(e), id(t), length) for f, e, t, length in connections]
+
+    def assertSameConnections(self, g):
+        g.invert_unsafe_intervals()
+        for node in g.nodes.values():
+            self.assertEqual(self.identities(node.get_safe_connections()),
+                             self.identities(self.nested_loop_connections(node)))
+
+    def test_equals_nested_loop(self):
+        for max_buffer, max_crt in ((0, 0), (100, 100)):
+            bg = graph_from_file("location_test.json")
+            scenario = scenario_from_file("scenario_test.json", bg,
+                                          train_agent_limited_flexibility_generator(max_buffer, max_crt))
+            scenario.process()
+            self.assertSameConnections(scenario.fsipp_view(scenario.agents[0]))
+            self.assertSameConnections(scenario.fsipp(scenario.agents[0]))
+
+
+class TestIncrementalUpdate(unittest.TestCase):
+
+    @staticmethod
+    def processed_scenario(change=None):
+        """
+        @param change: Function that changes the scenario before it is processed
+        """
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg,
+                                      train_agent_limited_flexibility_generator(100, 100))
+        if change is not None:
+            change(scenario)
+        scenario.process()
+        return scenario
+
+    @staticmethod
+    def interval_stores(scenario):
+        return [([(ui.start, ui.end, ui.duration, ui.by_agent.id, ui.local_recovery_time) for ui in ui.unsafe_intervals],
+                 ui.bt, ui.crt) for ui in list(scenario.g.nodes.values()) + scenario.g.edges]
+
+    def test_update_agent(self):
+        for start_time in (13, 16, 30):
+            scenario = self.processed_scenario()
+            flexSIPP = scenario.create_fsipp(scenario.agents[0])
+            changed_agent = copy(scenario.agents[1])
+            changed_agent.measures = replace(changed_agent.measures, start_time=start_time)
+            changed = scenario.update_agent(changed_agent)
+            flexSIPP.update(changed)
+
+            def change(expected_scenario):
+                expected_scenario.agents[1].measures.start_time = start_time
+            self.assertUpdated(scenario, flexSIPP, self.processed_scenario(change))
+
+    def assertUpdated(self, scenario, flexSIPP, expected):
+        self.assertEqual(self.interval_stores(scenario), self.interval_stores(expected))
+        self.assertEqual(list(flexSIPP.lines()), list(expected.create_fsipp(expected.agents[0]).lines()))
+
+    def test_update_stop_times(self):
+        def stop_edges(s):
+            agent = s.agents[1]
+            return agent, [e for block_e in agent.route[1:] for e in block_e.track_route if e.length > 0]
+
+        for index, departure_time in ((0, 60), (-1, 200)):
+            def change(s):
+                agent, edges = stop_edges(s)
+                edges[index].stops_at_station[agent.id] = departure_time
+
+            scenario = self.processed_scenario()
+            flexSIPP = scenario.create_fsipp(scenario.agents[0])
+            # Change the stop of the same agent object
+            change(scenario)
+            changed = scenario.update_agent(scenario.agents[1])
+            flexSIPP.update(changed)
+            self.assertUpdated(scenario, flexSIPP, self.processed_scenario(change))
+
+    def test_update_route(self):
+        def change(s):
+            s.agents[1].route = s.agents[1].route[:len(s.agents[1].route) // 2]
+
+        scenario = self.processed_scenario()
+        flexSIPP = scenario.create_fsipp(scenario.agents[0])
+        change(scenario)
+        changed = scenario.update_agent(scenario.agents[1])
+        flexSIPP.update(changed)
+        self.assertUpdated(scenario, flexSIPP, self.processed_scenario(change))
+
+
+class TestPrunedFSIPP(unittest.TestCase):
+
+    @staticmethod
+    def atf_values(flexSIPP):
+        node_of_interval = {si.index: node.name for node in flexSIPP.nodes.values() for si in node.safe_intervals}
+        return [(node_of_interval[atf.from_id], node_of_interval[atf.to_id], repr(atf).split(" ")[2:])
+                for atf in flexSIPP.atfs]
+
+    def test_relevant_nodes(self):
+        g = Graph()
+        a, b, c, d, e = (g.add_node(Node(name)) for name in "abcde")
+        for f, t in ((a, b), (b, c), (c, a), (d, a), (c, e)):
+            g.add_edge(Edge(f, t, 1, 1))
+        self.assertEqual(list(relevant_nodes(g, "a", "c")), ["a", "b", "c"])
+        self.assertEqual(list(relevant_nodes(g, "d", "e")), ["a", "b", "c", "d", "e"])
+        self.assertEqual(list(relevant_nodes(g, "e", "a")), [])
+
+    def test_prune(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg)
+        scenario.process()
+        for agent in scenario.agents:
+            pruned = scenario.create_fsipp(agent)
+            full = scenario.create_fsipp(agent, prune=False)
+            self.assertIn(agent.origin.name, pruned.nodes)
+            self.assertIn(agent.destination.name, pruned.nodes)
+            self.assertEqual(self.atf_values(pruned), [v for v in self.atf_values(full)
+                                                       if v[0] in pruned.nodes and v[1] in pruned.nodes])
+
+
+    def test_prune_corridor(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg)
+        scenario.process()
+        agent = scenario.agents[0]
+        flexSIPP = scenario.create_fsipp(agent)
+        flexSIPP.prune_corridor(agent.origin.name, 30)
+        intervals, atfs = flexSIPP._export()
+        exported = {si.index for node_intervals in intervals.values() for si in node_intervals}
+        self.assertLess(len(exported), sum(len(n.safe_intervals) for n in flexSIPP.nodes.values()))
+        self.assertLess(len(atfs), len(flexSIPP.atfs))
+        self.assertTrue(all(si.end >= 30 for si in intervals[agent.origin.name]))
+        for atf in atfs:
+            self.assertIn(atf.from_id, exported)
+            self.assertIn(atf.to_id, exported)
+
+
 class TestLimitedFlexibilityGenerator(unittest.TestCase):
 
     @staticmethod
@@ -45,5 +224,31 @@ class TestLimitedFlexibilityGenerator(unittest.TestCase):
             self.assertEqual(atf.crt_after, 0)
             self.assertEqual(atf.buffer_after, 0)
 
+class TestFSIPPView(unittest.TestCase):
+
+    @staticmethod
+    def atf_values(flexSIPP):
+        return [repr(atf).split(" ")[2:] for atf in flexSIPP.atfs]
+
+    def test_view_equals_fsipp(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg)
+        scenario.process()
+        heuristic = {node.name: 0 for node in bg.nodes.values()}
+        lengths = [e.length for e in bg.edges]
+        unsafe_intervals = [list(ui.unsafe_intervals) for ui in list(bg.nodes.values()) + bg.edges]
+
+        views = {a.id: FSIPP(scenario.fsipp_view(a), heuristic) for a in scenario.agents}
+        self.assertEqual([e.length for e in bg.edges], lengths)
+        self.assertEqual([list(ui.unsafe_intervals) for ui in list(bg.nodes.values()) + bg.edges], unsafe_intervals)
+        self.assertTrue(all(len(ui.safe_intervals) == 0 for ui in list(bg.nodes.values()) + bg.edges))
+
+        for agent_id, view in views.items():
+            bg = graph_from_file("location_test.json")
+            scenario = scenario_from_file("scenario_test.json", bg)
+            scenario.process()
+            flexSIPP = FSIPP(scenario.fsipp(agent_id), heuristic)
+            self.assertEqual(self.atf_values(view), self.atf_values(flexSIPP))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,18 +1,35 @@
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue as Q
+import sys
+import tempfile
 import unittest
 from copy import copy
 from typing import Tuple
 
 from flexsipp.generate import graph_from_file, scenario_from_file
+from flexsipp.graphs.dijkstra import dijkstra
 from flexsipp.graphs.fsipp import FSIPP
-from flexsipp.graphs.graph import IntervalStore
-from flexsipp.util.intervals import Interval
+from flexsipp.graphs.frozen_graph import FrozenGraph
+from flexsipp.graphs.graph import IntervalStore, Node
+from flexsipp.graphs.unsafe_intervals import ArrayUnsafeIntervals, SortedUnsafeIntervals
+from flexsipp.railways.block_graph import BlockEnumerator, BlockGraph
+from flexsipp.railways.graph_cache import CACHE_SOURCES, snapshot, clear_cache, cache_key
+from flexsipp.railways.track_graph import TrackGraph
+from flexsipp.railways.train_agent import TrainAgent
+from flexsipp.railways.train_agents.train_agent_acceleration import TrainAgentAcceleration
+from flexsipp.railways.train_agents.train_agent_braking_distance import TrainAgentBrakingDistance
+from flexsipp.util.intervals import Interval, UnsafeInterval
 
 
 class TestTrackGraph(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.tg = graph_from_file("location_test.json").tg
+        cls.tg = graph_from_file("location_test.json", use_cache=False).tg
 
     def test_general_track_graph(self):
         self.assertEqual(len(self.tg.nodes), 30, "In total 32 nodes")
@@ -105,7 +122,7 @@ class TestBlockGraph(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.bg = graph_from_file("location_test.json")
+        cls.bg = graph_from_file("location_test.json", use_cache=False)
 
     def test_general_block_graph(self):
         self.assertEqual(len(self.bg.nodes), 24, f"Should be 24 signals: {self.bg.nodes}")
@@ -140,6 +157,53 @@ class TestBlockGraph(unittest.TestCase):
         test_track_route("s1|A", ["s2A"])
         test_track_route("u|B", ["uA"])
 
+    def test_generate_signal_blocks(self):
+        def reference_signal_blocks(from_signal, signals):
+            # Breadth-first search that copies the routes, as generate_signal_blocks did before BlockEnumerator
+            end_tracks = {s.track.get_identifier() for s in signals}
+            result = []
+            queue = Q.Queue()
+            for start_track in [track.to_node for track in from_signal.track.outgoing]:
+                queue.put(([start_track], [], set(), 0.0, sys.maxsize))
+            while not queue.empty():
+                route, edge_route, visited, length, max_velocity = queue.get()
+                for e in route[-1].outgoing:
+                    if route[-1].get_identifier() in end_tracks:
+                        result.append((copy(route), edge_route + [e], length + e.length, min(max_velocity, e.max_speed)))
+                    elif route[-1] not in visited:
+                        queue.put((route + [e.to_node], edge_route + [e], visited | {e.to_node}, length + e.length,
+                                   min(max_velocity, e.max_speed)))
+            return result
+
+        tg = self.bg.tg
+        enumerator = BlockEnumerator(tg, tg.signals)
+        for signal in tg.signals:
+            self.assertEqual(self.bg.generate_signal_blocks(signal, tg.signals, enumerator),
+                             reference_signal_blocks(signal, tg.signals))
+            self.assertEqual(self.bg.generate_signal_blocks(signal, tg.signals),
+                             reference_signal_blocks(signal, tg.signals))
+
+    def test_parallel_construction(self):
+        sequential = BlockGraph.from_track_graph(TrackGraph.read_graph("location_test.json"))
+        for workers in (2, 3):
+            parallel = BlockGraph.from_track_graph(TrackGraph.read_graph("location_test.json"), workers)
+            self.assertEqual(snapshot(parallel), snapshot(sequential))
+            self.assertEqual([str(e) for e in parallel.edges], [str(e) for e in self.bg.edges])
+        # The workers get a snapshot of the track graph if they are not forked
+        spawned = BlockGraph.from_track_graph(TrackGraph.read_graph("location_test.json"), 2,
+                                              multiprocessing.get_context("spawn"))
+        self.assertEqual(snapshot(spawned), snapshot(sequential))
+
+    def test_conflict_index(self):
+        index = self.bg.conflict_index
+        self.assertIs(self.bg.conflict_index, index)
+        self.assertEqual(len(index), len(self.bg.tg.edges))
+        for e in self.bg.tg.edges:
+            self.assertCountEqual(index[e].interval_stores, e.blocks.union(e.from_node.blocks))
+            self.assertEqual(list(index[e].plotting_edges), e.opposites + e.associated + [e])
+        with self.assertRaises(TypeError):
+            index[self.bg.tg.edges[0]] = index[self.bg.tg.edges[1]]
+
     def test_track_graph_relation_diverging_switch(self):
         node = self.bg.nodes["s5|A"]
         self.assertEqual(len(node.outgoing), 2)
@@ -155,6 +219,66 @@ class TestBlockGraph(unittest.TestCase):
         #TODO: should this include the starting track, currently does not
         self.assertEqual(len(path), 8, f"Length of path should be 9: {path}")
 
+    def test_distance_oracle(self):
+        start_a, start_b = self.bg.get_block_from_station("U|1")
+        end_a, end_b = self.bg.get_block_from_station("V|1")
+        for start in (start_a, start_b):
+            distances = self.bg.calculate_distances(start, 10)
+            for end in (end_a, end_b):
+                self.assertEqual(self.bg.distance_oracle.distance(start, end, 10), distances[end.name])
+        self.assertEqual(self.bg.get_initial_direction((start_a, start_b), (end_a, end_b), 10), 0)
+
+    def test_station_without_blocks(self):
+        # Track w only has an A signal, a station on it must not break loading a scenario
+        with open("location_test.json") as f:
+            location = json.load(f)
+        location["stations"].append({"stationName": "w", "platform": "1", "trackId": 3})
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "location.json")
+            with open(file, "w") as f:
+                json.dump(location, f)
+            bg = graph_from_file(file, use_cache=False)
+        with self.assertRaises(StopIteration):
+            bg.get_block_from_station("W|1")
+        self.assertEqual(bg.distance_oracle.terminals, {b.name for station in ("U|1", "V|1", "UHAT|1", "VHAT|1")
+                                                        for b in bg.get_block_from_station(station)})
+        scenario = scenario_from_file("scenario_test.json", bg)
+        scenario.process()
+        self.assertEqual(len(scenario.agents), 2)
+
+    def test_freeze(self):
+        fg = self.bg.freeze()
+        self.assertIs(self.bg.freeze(), fg)
+        self.assertEqual(fg.n_nodes, len(self.bg.nodes))
+        self.assertEqual(fg.n_edges, len(self.bg.edges))
+        for node in self.bg.nodes.values():
+            u = fg.index[node.name]
+            out_edges = fg.out_edges[fg.out_offsets[u]:fg.out_offsets[u + 1]]
+            in_edges = fg.in_edges[fg.in_offsets[u]:fg.in_offsets[u + 1]]
+            self.assertEqual([fg.edges[e] for e in out_edges], node.outgoing)
+            self.assertEqual([fg.edges[e] for e in in_edges], node.incoming)
+        with self.assertRaises(ValueError):
+            fg.length[0] = 0
+
+    def test_heuristics(self):
+        fg = self.bg.freeze()
+        goals = [self.bg.nodes["v|A"], self.bg.nodes["uHat|B"]]
+        heuristics = self.bg.calculate_heuristics(goals, 10)
+        self.assertEqual(heuristics.shape, (2, len(self.bg.nodes)))
+        for goal, row in zip(goals, heuristics):
+            expected, _ = dijkstra(fg, fg.index[goal.name], 10, reverse=True)
+            self.assertEqual(row.tolist(), expected)
+        self.assertEqual(self.bg.calculate_heuristic(goals[1], 10),
+                         dict(zip(fg.names(), heuristics[1].tolist())))
+
+    def test_shortest_path_tree_cache(self):
+        start_a, _ = self.bg.get_block_from_station("U|1")
+        tree = self.bg.shortest_path_tree(start_a, 10)
+        self.assertIs(self.bg.shortest_path_tree(start_a, 10), tree)
+        self.assertIsNot(self.bg.shortest_path_tree(start_a, 20), tree)
+        self.bg.invalidate_shortest_paths()
+        self.assertIsNot(self.bg.shortest_path_tree(start_a, 10), tree)
+
 
 class TestScenario(unittest.TestCase):
 
@@ -213,6 +337,164 @@ class TestUnsafeIntervals(unittest.TestCase):
             test_unsafe(edge, [(8, 9), (10, 11)])
 
 
+class TestArrayUnsafeIntervals(TestUnsafeIntervals):
+
+    @classmethod
+    def setUpClass(cls):
+        bg = graph_from_file("location_test.json")
+        bg.set_unsafe_interval_store(ArrayUnsafeIntervals)
+        scenario = scenario_from_file("scenario_test.json", bg)
+        scenario.process()
+        cls.g = scenario.g
+
+    def test_filter_out_agent(self):
+        agent_1 = self.g.nodes["w|A"].unsafe_intervals[0].by_agent
+        for ui in list(self.g.nodes.values()) + self.g.edges:
+            self.assertIsInstance(ui.unsafe_intervals, ArrayUnsafeIntervals)
+            filtered = ui.filter_out_agent(agent_1)
+            self.assertCountEqual(filtered, [i for i in ui.unsafe_intervals if i.by_agent.id != agent_1.id])
+
+    def test_same_as_sorted(self):
+        def intervals(store):
+            bg = graph_from_file("location_test.json")
+            bg.set_unsafe_interval_store(store)
+            scenario = scenario_from_file("scenario_test.json", bg)
+            scenario.process()
+            return {ui: ([(i.start, i.end, i.duration, i.by_agent.id, i.local_recovery_time) for i in ui.unsafe_intervals],
+                         ui.bt, ui.crt) for ui in list(scenario.g.nodes.values()) + scenario.g.edges}
+
+        sorted_intervals = intervals(SortedUnsafeIntervals)
+        array_intervals = intervals(ArrayUnsafeIntervals)
+        self.assertEqual(list(map(str, sorted_intervals)), list(map(str, array_intervals)))
+        for (ui, expected), actual in zip(sorted_intervals.items(), array_intervals.values()):
+            self.assertEqual(actual, expected, ui)
+
+
+class TestTrainAgent(unittest.TestCase):
+
+    def test_route_index(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg)
+        for agent in scenario.agents:
+            for block in agent.route:
+                for e in block.track_route:
+                    bools = [e in b.track_route for b in agent.route]
+                    self.assertEqual(agent._route_index[e], bools.index(True))
+            self.assertEqual(agent._approach_blocks(agent.route[0].track_route[0], 10), set())
+
+    def test_braking_distance(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg, TrainAgentBrakingDistance)
+        agent = scenario.agents[0]
+        # Braking distance of 50m at 100m/s within the first block of 100m, 150m within the first two blocks
+        self.assertEqual(agent._approach_block_count(0, 0), 0)
+        self.assertEqual(agent._approach_block_count(0, 100), 1)
+        self.assertEqual(agent._approach_block_count(0, math.sqrt(150 * 2 * 100)), 2)
+        self.assertEqual(agent._approach_block_count(len(agent.route) - 1, 1000), 1)
+        e = agent.route[1].track_route[0]
+        self.assertEqual(agent._approach_blocks(e, 100), {b for tr in agent.route[1].track_route for b in tr.blocks})
+        scenario.process()
+
+    def test_blocking_times(self):
+        def reference_blocking_times(agent, acceleration):
+            # Edge by edge calculation of calculate_blocking_times before blocking_times
+            m = agent.measures
+            cur_time = m.start_time
+            velocity = 0.0
+            result = []
+            for e in [e for block_e in agent.route for e in block_e.track_route]:
+                station_time = 0
+                stops = agent.id in e.stops_at_station
+                if stops:
+                    station_time = e.stops_at_station[agent.id] - cur_time
+                    velocity = 0
+                if e.length > 0:
+                    max_train_v = min(e.max_speed, m.train_speed)
+                    if not acceleration:
+                        avg_v = velocity = max_train_v
+                    else:
+                        a = m.acceleration if max_train_v > 0 else m.deceleration * -1
+                        l_min = ((max_train_v ** 2) - (velocity ** 2)) / (2 * a)
+                        if l_min >= e.length:
+                            avg_v = (velocity + math.sqrt((velocity ** 2) + 2 * a * e.length)) / 2
+                            velocity = velocity + (e.length / avg_v) * a
+                        else:
+                            avg_v = e.length / (((max_train_v - velocity) / a) + ((e.length - l_min) / max_train_v))
+                            velocity = max_train_v
+                    end = cur_time + e.length / avg_v + m.train_length / velocity + station_time + m.release_time
+                    duration = e.length / avg_v + station_time
+                    recovery = (e.length / avg_v) - e.length / (avg_v * 1.08)
+                else:
+                    avg_v = velocity
+                    end = cur_time + station_time + m.release_time
+                    duration = station_time
+                    recovery = 0
+                if stops:
+                    recovery = max(0.0, station_time - m.minimum_stop_time)
+                approach_start = cur_time + station_time - m.setup_time - m.sight_reaction_time
+                approach_end = cur_time + station_time
+                if avg_v > 0:
+                    approach_end += e.length / avg_v
+                result.append((cur_time, end, duration, recovery, approach_start, approach_end, avg_v, velocity))
+                cur_time = approach_end
+            return result
+
+        for agent_cls in (TrainAgent, TrainAgentAcceleration):
+            bg = graph_from_file("location_test.json")
+            scenario = scenario_from_file("scenario_test.json", bg, agent_cls)
+            agent = scenario.agents[0]
+            track_edges = [e for block_e in agent.route for e in block_e.track_route]
+            # Stop on a track with and on a track without length
+            stops = [next(e for e in track_edges[2:] if e.length > 0), next(e for e in track_edges if e.length == 0)]
+            for time, e in zip((20, 40), sorted(stops, key=track_edges.index)):
+                e.stops_at_station[agent.id] = time
+            try:
+                times = agent._blocking_times(track_edges)
+                self.assertEqual(list(zip(times.start.tolist(), times.end.tolist(), times.duration.tolist(),
+                                          times.recovery.tolist(), times.approach_start.tolist(),
+                                          times.approach_end.tolist(), times.velocity.tolist(),
+                                          times.end_velocity.tolist())),
+                                 reference_blocking_times(agent, agent_cls is TrainAgentAcceleration))
+                self.assertGreater(times.recovery.max(), 0)
+            finally:
+                for e in stops:
+                    del e.stops_at_station[agent.id]
+
+
+class TestGraphCache(unittest.TestCase):
+
+    def test_cache(self):
+        fresh = graph_from_file("location_test.json", use_cache=False)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            created = graph_from_file("location_test.json", cache_dir=cache_dir)
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, cache_key("location_test.json") + ".graph.pickle")))
+            cached = graph_from_file("location_test.json", cache_dir=cache_dir)
+            for g in (created, cached):
+                self.assertEqual(snapshot(g), snapshot(fresh))
+                for ui, fresh_ui in zip(list(g.tg.nodes.values()) + g.tg.edges,
+                                        list(fresh.tg.nodes.values()) + fresh.tg.edges):
+                    self.assertEqual(sorted(map(str, ui.blocks)),
+                                     sorted(map(str, fresh_ui.blocks)))
+            self.assertEqual(clear_cache(cache_dir), 1)
+            self.assertEqual(os.listdir(cache_dir), [])
+        # The block order depends on the enumerator and the frozen graph it runs on
+        for module in (BlockEnumerator.__module__, FrozenGraph.__module__):
+            self.assertIn(sys.modules[module].__file__, CACHE_SOURCES)
+
+    def test_scenario_on_cached_graph(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            graph_from_file("location_test.json", cache_dir=cache_dir)
+            graphs = [graph_from_file("location_test.json", cache_dir=cache_dir),
+                      graph_from_file("location_test.json", use_cache=False)]
+        scenarios = [scenario_from_file("scenario_test.json", bg) for bg in graphs]
+        for scenario in scenarios:
+            scenario.process()
+        cached, fresh = graphs
+        for name, node in fresh.nodes.items():
+            self.assertEqual([(i.start, i.end) for i in cached.nodes[name].unsafe_intervals],
+                             [(i.start, i.end) for i in node.unsafe_intervals])
+
+
 class TestSafeIntervals(unittest.TestCase):
 
     @classmethod
@@ -232,6 +514,16 @@ class TestSafeIntervals(unittest.TestCase):
         node = self.fsipp.g.nodes["s2|A"]
         self.assertCountEqual(node.safe_intervals, [Interval(a, b) for a,b in [(0, 4), (5, 14), (15, 36)]])
 
+    def test_overlapping_unsafe_intervals(self):
+        # The safe interval between two overlapping unsafe intervals is left out, without using an id
+        node = Node("n")
+        ids = itertools.count()
+        unsafe = [UnsafeInterval(2, 6, 4, 1, 0.0), UnsafeInterval(4, 8, 4, 2, 0.0), UnsafeInterval(10, 12, 2, 1, 0.0)]
+        safe = node.create_safe_intervals(unsafe, 20, ids)
+        self.assertEqual([(si.start, si.end) for si in safe], [(0, 2), (6, 10), (12, 20)])
+        self.assertEqual([si.index for si in safe], [0, 1, 2])
+        self.assertEqual(next(ids), 3)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 
-from flexsipp.util.intervals import Interval
+from flexsipp.util.intervals import Interval, UnsafeInterval, SafeInterval
 
 
 class TestInterval(unittest.TestCase):
@@ -20,6 +20,15 @@ class TestInterval(unittest.TestCase):
         self.assertTrue(Interval(1, 2) & Interval(0, 3))
         self.assertFalse(Interval(1, 2) & Interval(3, 4))
 
+    def test_overlaps(self):
+        for a, b in [((1, 2), (2, 3)), ((1, 2), (0, 3)), ((1, 2), (3, 4)), ((2, 1), (0, 3)), ((0, 3), (2, 1))]:
+            self.assertEqual(Interval(*a).overlaps(Interval(*b)), bool(Interval(*a) & Interval(*b)))
+
+    def test_slots(self):
+        for interval in [Interval(1, 2), UnsafeInterval(1, 2, 1, 0, 0), SafeInterval(1, 2, 0, 0, 0, 0, 0)]:
+            self.assertFalse(hasattr(interval, "__dict__"))
+            self.assertEqual(interval.index, -1)
+
     def test_merge(self):
         a = Interval(1, 2)
         a.merge(Interval(2, 3))
@@ -0,0 +1,106 @@
+import math
+import unittest
+
+import matplotlib
+import numpy as np
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from flexsipp.util.compound_atf import CompoundATF, PathATF
+from flexsipp.util.results import Results, ResultsParser
+
+# Output of a search, without the debug lines before the results
+OUTPUT = "\n".join([
+    "Nodes generated: 145 Nodes decreased: 0 Nodes expanded: 127",
+    "<-inf,3,11,11>, <3,4,11,12>, <4,17,25,25>, <17,28,25,36>, <28,inf,inf,inf>, ",
+    "u|A <0,36> ns:2 []",
+    "v|A <11,inf> ns:1 []",
+    "<-inf,3,4,8,[<0: 0: 0: : 0>; ]>",
+    "u|A <0,36> ns:2 []",
+    "v|A <11,inf> ns:1 []",
+    "<-inf,17,28,8,[<0: 0: 0: : 0>; ]>",
+    "<0,0,inf,inf,[0 bt: 0 crt: 0, 0 bt: 0 crt: 0]>",
+    "Search time: 45 milliseconds",
+])
+
+
+class TestResults(unittest.TestCase):
+
+    def test_parse(self):
+        r = Results(OUTPUT)
+        self.assertEqual(r.metadata["Nodes expanded"], "127")
+        self.assertEqual(r.metadata["Search time"], "45")
+        self.assertEqual(r.catf[1], ("3.0", "4.0", "11.0", "12.0"))
+        self.assertEqual(r.unique_paths, {"u|A;v|A": 2})
+        self.assertEqual(len(r.unique_path_eatfs["u|A;v|A"]), 2)
+        np.testing.assert_array_equal(r.unique_path_eatf_values["u|A;v|A"], [[-math.inf, 3, 4, 8], [-math.inf, 17, 28, 8]])
+        self.assertEqual(r.catf, Results.from_lines(line + "\n" for line in OUTPUT.splitlines()).catf)
+
+    def test_parser(self):
+        parser = ResultsParser(Results(), offset=100)
+        for line in ("debug output\n" + OUTPUT + "\nnot parsed").splitlines(keepends=True):
+            self.assertFalse(parser.done)
+            parser.feed(line)
+            if line.startswith("Search time"):
+                break
+        self.assertTrue(parser.done)
+        r = parser.finish()
+        expected = Results.from_lines(OUTPUT.splitlines(), offset=100)
+        self.assertEqual((r.metadata, r.catf, r.unique_path_eatfs), (expected.metadata, expected.catf, expected.unique_path_eatfs))
+        np.testing.assert_array_equal(r.catf_values, expected.catf_values)
+        for lines in (["debug output"], OUTPUT.splitlines()[:1]):
+            parser = ResultsParser(Results())
+            for line in lines:
+                parser.feed(line)
+            with self.assertRaises(ValueError):
+                parser.finish()
+
+    def test_offset(self):
+        r = Results.from_lines(OUTPUT.splitlines(), offset=100)
+        self.assertEqual(r.catf[1], ("-97.0", "-96.0", "-89.0", "-88.0"))
+        np.testing.assert_array_equal(r.catf_values, [[float(x) for x in segment] for segment in r.catf])
+        np.testing.assert_array_equal(r.unique_path_eatf_values["u|A;v|A"],
+                                      [[-math.inf, -97, -96, 8], [-math.inf, -83, -72, 8]])
+
+    def test_offset_arrival_time(self):
+        r = Results.from_lines(OUTPUT.splitlines(), offset=100)
+        for x0, x1, y0, y1 in ([float(x) for x in segment] for segment in r.catf):
+            if math.isfinite(x0) and math.isfinite(x1):
+                # At x0 the previous segment gives the arrival time
+                self.assertEqual(r.arrival_time((x0 + x1) / 2), (y0 + y1) / 2)
+                self.assertEqual(r.arrival_time(x1), y1)
+        # The plotted segments are the string catf
+        _, ax = plt.subplots()
+        r.plot(ax)
+        self.assertEqual([[float(y) for y in line.get_ydata()] for line in ax.get_lines()],
+                         [[float(segment[2]), float(segment[3])] for segment in r.catf])
+        plt.close()
+
+    def test_compound_atf(self):
+        r = Results(OUTPUT)
+        self.assertEqual(r.arrival_time(0), 11)
+        self.assertEqual(r.arrival_time(3.5), 11.5)
+        self.assertEqual(r.arrival_time(4), 12)
+        self.assertEqual(r.arrival_time(10), 25)
+        self.assertEqual(r.arrival_time(20), 28)
+        self.assertEqual(r.arrival_time(30), math.inf)
+        times = np.linspace(-5, 35, 81)
+        np.testing.assert_array_equal(r.arrival_time(times), [r.arrival_time(float(t)) for t in times])
+
+    def test_path_atf(self):
+        r = Results(OUTPUT)
+        path = r.unique_path_atfs["u|A;v|A"]
+        self.assertEqual(path.arrival_time(3.5), 11.5)
+        self.assertEqual(path.arrival_time(30), math.inf)
+        # The compound ATF is made of the edge ATFs of the only path
+        times = np.linspace(-5, 35, 81)
+        np.testing.assert_array_equal(path.arrival_time(times), r.arrival_time(times))
+
+    def test_empty(self):
+        self.assertEqual(CompoundATF(np.empty((0, 4))).arrival_time(1.0), math.inf)
+        self.assertEqual(PathATF(np.empty((0, 4))).arrival_time(np.zeros(3)).tolist(), [math.inf] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
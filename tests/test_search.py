@@ -1,8 +1,17 @@
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import tempfile
 import unittest
 from copy import copy
+from unittest import mock
 
 from flexsipp.generate import graph_from_file, scenario_from_file
-from flexsipp.graphs.fsipp import FSIPP
+from flexsipp.graphs.binary_edge_graph import read_binary_edge_graph
+from flexsipp.graphs import fsipp
+from flexsipp.graphs.fsipp import FSIPP, run_searches
+from flexsipp.util.results import Results
 from flexsipp.railways.train_agents.train_agent_limited_flexiblity import train_agent_limited_flexibility_generator
 
 class TestSearch(unittest.TestCase):
@@ -22,5 +31,110 @@ class TestSearch(unittest.TestCase):
         result = self.flexSIPP.run_search(1000, self.new_agent.origin.name, self.new_agent.destination.name, self.new_agent.measures.start_time)
         print(result)
 
+    def test_binary_search(self):
+        self.setUpScenario(0, 0)
+        search = (self.new_agent.origin.name, self.new_agent.destination.name, self.new_agent.measures.start_time)
+        result = self.flexSIPP.run_search(1000, *search)
+        binary_result = self.flexSIPP.run_search(1000, *search, file="flexsipp.bin", binary=True)
+        self.assertEqual(binary_result.catf, result.catf)
+
+    def test_read_binary(self):
+        self.setUpScenario(0, 0)
+        self.flexSIPP.write("flexsipp.bin", binary=True)
+        graph = read_binary_edge_graph("flexsipp.bin")
+        lines = list(self.flexSIPP.lines())
+        self.assertEqual(lines[-1], f"num_trains {graph.num_trains}\n")
+        vertex_lines = lines[2:2 + len(graph.vertices)]
+        atf_lines = lines[2 + len(graph.vertices):-1]
+        self.assertEqual(len(atf_lines), len(graph.atfs))
+        for line, name, vertex in zip(vertex_lines, graph.vertex_names(), graph.vertices.tolist()):
+            self.assertEqual(line.split()[0], name)
+            self.assertEqual([float(x) for x in line.split()[1:]], list(vertex[1:]))
+        for line, atf in zip(atf_lines, graph.atfs.tolist()):
+            self.assertEqual([float(x) for x in line.split()], list(atf))
+
+    def test_pruned_search(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg, train_agent_limited_flexibility_generator(0, 0))
+        scenario.process()
+        agent = scenario.agents[0]
+        search = (agent.origin.name, agent.destination.name, agent.measures.start_time)
+        pruned = scenario.create_fsipp(agent).run_search(1000, *search)
+        full = scenario.create_fsipp(agent, prune=False).run_search(1000, *search)
+        self.assertGreater(len(pruned.catf), 0)
+        self.assertEqual(pruned.catf, full.catf)
+
+    def test_corridor_search(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg, train_agent_limited_flexibility_generator(0, 0))
+        scenario.process()
+        agent = scenario.agents[0]
+        for start_time in (agent.measures.start_time, agent.measures.start_time + 10):
+            flexSIPP = scenario.create_fsipp(agent)
+            search = (agent.origin.name, agent.destination.name, start_time)
+            full = flexSIPP.run_search(1000, *search)
+            flexSIPP.prune_corridor(agent.origin.name, start_time)
+            pruned = flexSIPP.run_search(1000, *search)
+            self.assertEqual(pruned.catf, full.catf)
+
+    def test_async_search(self):
+        self.setUpScenario(0, 0)
+        search = (self.flexSIPP, self.new_agent.origin.name, self.new_agent.destination.name, self.new_agent.measures.start_time)
+        result = self.flexSIPP.run_search(1000, *search[1:])
+        results = asyncio.run(run_searches([search] * 3, 1000, max_concurrent=2))
+        results += asyncio.run(run_searches([search] * 2, 1000, binary=True))
+        # Without /dev/stdin the edge graphs are written to temporary files
+        with mock.patch.object(fsipp, "STDIN", "/nonexistent/stdin"):
+            results += asyncio.run(run_searches([search] * 2, 1000))
+            results += asyncio.run(run_searches([search], 1000, binary=True))
+        self.assertEqual(len(results), 8)
+        for r in results:
+            self.assertIsInstance(r, Results)
+            self.assertEqual(r.catf, result.catf)
+            self.assertEqual(r.unique_path_eatfs, result.unique_path_eatfs)
+
+    def test_streamed_results(self):
+        self.setUpScenario(0, 0)
+        search = (self.new_agent.origin.name, self.new_agent.destination.name, self.new_agent.measures.start_time)
+        result = self.flexSIPP.run_search(1000, *search)
+        with open("flexsipp_out.txt", "wt") as f:
+            subprocess.run(FSIPP._search_command(*search[:2], "flexsipp.txt", search[2]), stdout=f, check=True)
+        with open("flexsipp_out.txt") as f:
+            output = f.read()
+        streamed = Results.from_file("flexsipp_out.txt")
+        os.remove("flexsipp_out.txt")
+        for r in [Results(output), streamed]:
+            self.assertEqual(r.catf, result.catf)
+            self.assertEqual(r.unique_paths, result.unique_paths)
+            self.assertEqual(r.unique_path_eatfs, result.unique_path_eatfs)
+        self.assertEqual(result.catf_values.shape, (len(result.catf), 4))
+        for values, catf in zip(result.catf_values, result.catf):
+            self.assertEqual([round(v, 2) for v in values], [float(x) for x in catf])
+        for path, eatfs in result.unique_path_eatfs.items():
+            self.assertEqual(len(result.unique_path_eatf_values[path]), len(eatfs))
+            for values, eatf in zip(result.unique_path_eatf_values[path], eatfs):
+                self.assertEqual([round(v, 2) for v in values[:3]], [float(x) for x in eatf[:3]])
+
+    def test_replan_all(self):
+        bg = graph_from_file("location_test.json")
+        scenario = scenario_from_file("scenario_test.json", bg, train_agent_limited_flexibility_generator(0, 0))
+        scenario.process()
+        replanned = scenario.replan_all(workers=2)
+        self.assertEqual([r.agent_id for r in replanned], [a.id for a in scenario.agents])
+        for r in replanned:
+            self.assertIsNotNone(r.results)
+            self.assertGreater(len(r.results.catf), 0)
+        sequential = scenario.replan_all(workers=1)
+        self.assertEqual([r.results.catf for r in replanned], [r.results.catf for r in sequential])
+        # Workers that are not forked replan on a snapshot of the processed scenario
+        spawned = scenario.replan_all(workers=2, mp_context=multiprocessing.get_context("spawn"))
+        self.assertEqual([r.agent_id for r in spawned], [r.agent_id for r in sequential])
+        self.assertEqual([(r.results.catf, r.results.unique_path_eatfs) for r in spawned],
+                         [(r.results.catf, r.results.unique_path_eatfs) for r in sequential])
+        with tempfile.TemporaryDirectory() as directory:
+            in_directory = scenario.replan_all(workers=1, directory=directory)
+            self.assertEqual(len(os.listdir(directory)), len(scenario.agents))
+        self.assertEqual([r.results.catf for r in in_directory], [r.results.catf for r in sequential])
+
 if __name__ == '__main__':
     unittest.main()